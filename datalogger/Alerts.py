@@ -0,0 +1,198 @@
+'''
+Created on 19.10.2026
+
+@license: pylarexx is licensed under the Apache License, version 2, see License.txt
+
+Alert rules of the config section "alerts", evaluated with every reading as it is received.
+Rules are indexed by sensor id, so a reading only evaluates the rules of its sensor. Each rule keeps
+a small state per sensor (and cluster node) that is updated with every reading. An alert is sent when
+a rule starts firing and again when it is resolved, the outputs get it with onAlert.
+'''
+
+import time
+import logging
+import collections
+import yaml
+
+
+class AlertRule(object):
+    '''
+    Base class of the rules. The checked value is compared with above and/or below. While a rule is firing,
+    it resolves only when the value is back by hysteresis.
+    '''
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.sensorid = str(int(spec['sensor']))
+        self.name = str(spec.get('name', '%s %s' % (spec.get('type', 'threshold'), self.sensorid)))
+        self.above = None if spec.get('above') is None else float(spec['above'])
+        self.below = None if spec.get('below') is None else float(spec['below'])
+        if self.above is None and self.below is None:
+            raise ValueError('alert %s needs above or below' % self.name)
+        self.hysteresis = float(spec.get('hysteresis', 0))
+        self.states = {}
+
+    def violated(self, value, firing):
+        margin = self.hysteresis if firing else 0.0
+        return ((self.above is not None and value > self.above - margin)
+                or (self.below is not None and value < self.below + margin))
+
+    def update(self, key, value, timestamp):
+        '''
+        returns (firing, checked value) if the rule started firing or was resolved, else None
+        '''
+        raise NotImplementedError
+
+    def limitText(self):
+        limits = []
+        if self.above is not None:
+            limits.append('above %g' % self.above)
+        if self.below is not None:
+            limits.append('below %g' % self.below)
+        return ' or '.join(limits)
+
+
+class ThresholdRule(AlertRule):
+    '''
+    fires while the value is above or below the limits
+    '''
+
+    def update(self, key, value, timestamp):
+        firing = self.states.get(key, False)
+        violated = self.violated(value, firing)
+        if violated == firing:
+            return None
+        self.states[key] = violated
+        return violated, value
+
+    def describe(self, value):
+        return 'value %g is %s' % (value, self.limitText())
+
+
+class RateRule(AlertRule):
+    '''
+    fires while the change per minute over the last window seconds (default 600) is above or below the limits
+    '''
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.window = float(spec.get('window', 600))
+
+    def update(self, key, value, timestamp):
+        state = self.states.get(key)
+        if state is None:
+            state = [collections.deque(), False]
+            self.states[key] = state
+        history = state[0]
+        # readings of several receivers and the flash backlog come twice or out of order
+        if len(history) > 0 and timestamp <= history[-1][0]:
+            return None
+        history.append((timestamp, value))
+        while timestamp - history[0][0] > self.window:
+            history.popleft()
+        if len(history) < 2:
+            return None
+        rate = (value - history[0][1]) * 60.0 / (timestamp - history[0][0])
+        violated = self.violated(rate, state[1])
+        if violated == state[1]:
+            return None
+        state[1] = violated
+        return violated, rate
+
+    def describe(self, rate):
+        return 'value changes by %g per minute, limit %s' % (rate, self.limitText())
+
+
+class SustainedRule(AlertRule):
+    '''
+    fires when the value is above or below the limits for at least "for" seconds
+    '''
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.duration = float(spec.get('for', 300))
+
+    def update(self, key, value, timestamp):
+        state = self.states.get(key)
+        if state is None:
+            state = [None, False, 0]  # start of the violation, firing, last timestamp
+            self.states[key] = state
+        if timestamp <= state[2]:
+            return None
+        state[2] = timestamp
+        if not self.violated(value, state[1]):
+            state[0] = None
+            if state[1]:
+                state[1] = False
+                return False, value
+            return None
+        if state[0] is None:
+            state[0] = timestamp
+        if not state[1] and timestamp - state[0] >= self.duration:
+            state[1] = True
+            return True, value
+        return None
+
+    def describe(self, value):
+        return 'value %g is %s for %d seconds' % (value, self.limitText(), self.duration)
+
+
+RULE_TYPES = {'threshold': ThresholdRule, 'rate': RateRule, 'sustained': SustainedRule}
+
+
+class AlertEngine(object):
+    '''
+    Holds the rules by sensor id. evaluate is called for every reading and returns the alerts it caused.
+    '''
+
+    def __init__(self):
+        self.rules = {}  # sensor id -> list of rules
+
+    def configure(self, specs):
+        '''
+        builds the rules of the config section alerts. Rules that did not change keep their state.
+        '''
+        old = {}
+        for rules in self.rules.values():
+            for rule in rules:
+                old[yaml.dump(rule.spec, sort_keys=True)] = rule
+        index = {}
+        for spec in specs or []:
+            try:
+                rule = old.get(yaml.dump(spec, sort_keys=True))
+                if rule is None:
+                    ruleType = spec.get('type', 'threshold')
+                    if ruleType not in RULE_TYPES:
+                        raise ValueError('unknown alert type %s' % ruleType)
+                    rule = RULE_TYPES[ruleType](spec)
+                    logging.info("Adding alert %s for sensor %s", rule.name, rule.sensorid)
+                index.setdefault(rule.sensorid, []).append(rule)
+            except Exception as e:
+                logging.error('Error in config section alerts: %s', e)
+                logging.debug('Stacktrace: ', exc_info=True)
+        self.rules = index
+
+    def evaluate(self, key, sensor, datapoint):
+        '''
+        key identifies the state of the sensor, e.g. the sensor id or (node, sensor id) for cluster nodes
+        '''
+        rules = self.rules.get(sensor.id)
+        if rules is None:
+            return []
+        value = sensor.rawToCooked(datapoint['rawvalue'])
+        alerts = []
+        for rule in rules:
+            change = rule.update(key, value, datapoint['timestamp'])
+            if change is None:
+                continue
+            firing, checked = change
+            alert = {'rule': rule.name, 'type': rule.spec.get('type', 'threshold'),
+                     'state': 'firing' if firing else 'resolved', 'sensorid': sensor.displayid,
+                     'sensorname': sensor.name, 'sensortype': sensor.type, 'unit': sensor.unit,
+                     'value': value, 'timestamp': datapoint['timestamp'], 'time': time.time(),
+                     'message': rule.describe(checked) if firing else 'resolved'}
+            if 'node' in datapoint:
+                alert['node'] = datapoint['node']
+            logging.warning("Alert %s of sensor %s: %s", rule.name, sensor.displayid, alert['message'])
+            alerts.append(alert)
+        return alerts
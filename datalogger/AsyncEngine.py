@@ -0,0 +1,291 @@
+'''
+Created on 19.10.2026
+
+@license: pylarexx is licensed under the Apache License, version 2, see License.txt
+
+asyncio based polling engine (pylarexx.py --engine asyncio). USB I/O runs in a single executor thread,
+each device is polled by its own task and maintenance runs between polling rounds.
+Listeners with "async def onNewData" (and optionally async flush/close) run as tasks on the event loop.
+Synchronous listeners are called in their own executor thread, so a blocking output does not stall
+the loop and readings reach each listener in order.
+'''
+
+import time
+import asyncio
+import signal
+import logging
+import concurrent.futures
+from datalogger.Logger import TLX00
+from datalogger.DataListener import RecentValuesListener
+from datalogger.LogUtil import rateLimited
+
+
+class AsyncTLX00(TLX00):
+
+    asyncListeners = True
+    MAX_PENDING = 1000  # dispatched but not yet handled readings before polling waits
+
+    def __init__(self, params):
+        self.usbExecutor = concurrent.futures.ThreadPoolExecutor(1, 'pylarexx-usb')
+        self.listenerExecutors = {}
+        self.pending = set()
+        self.asyncStop = None
+        self.eventLoop = None
+        super().__init__(params)
+
+    def run(self):
+        asyncio.run(self.main())
+
+    async def main(self):
+        loop = asyncio.get_running_loop()
+        self.eventLoop = loop
+        self.asyncStop = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.requestShutdown)
+        loop.add_signal_handler(signal.SIGHUP, self.requestReload)
+        await self.runInUsb(self.findDevices)
+        await self.runInUsb(self.initializeDevices)
+        self.clearRequestBuffer()
+        tasks = {}
+        try:
+            while self.running and len(self.listeners) > 0:
+                for dev in list(self.devices):
+                    if dev not in tasks or tasks[dev].done():
+                        tasks[dev] = asyncio.create_task(self.pollDevice(dev))
+                for dev in [d for d, t in tasks.items() if t.done()]:
+                    tasks.pop(dev)
+                if await self.sleep(4):
+                    break
+                await self.maintenanceAsync()
+        finally:
+            self.running = False
+            self.asyncStop.set()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            await self.shutdownAsync()
+
+    def requestShutdown(self, signum=None, frame=None):
+        super().requestShutdown(signum, frame)
+        if self.asyncStop is not None:
+            self.asyncStop.set()
+
+    async def sleep(self, seconds):
+        '''
+        returns True if a shutdown was requested while sleeping
+        '''
+        try:
+            await asyncio.wait_for(self.asyncStop.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        return self.asyncStop.is_set()
+
+    async def runInUsb(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.usbExecutor, func, *args)
+
+    async def pollDevice(self, dev):
+        '''
+        reads all new data of a device, then sleeps. Ends when the device is removed.
+        '''
+        while self.running and dev in self.devices:
+            logging.debug("Polling device at Bus %d Address %d Port Number %d", dev.bus, dev.address, dev.port_number)
+            await self.runInUsb(self.maintainDevice, dev)
+            readcount = 0
+            founddata = 0
+            while self.running:
+                try:
+                    datapoints = await self.runInUsb(self.readPacket, dev)
+                    if datapoints is None:
+                        break
+                    for datapoint in datapoints:
+                        sensor = self.sensorForDatapoint(datapoint)
+                        if sensor is not None:
+                            await self.dispatch(datapoint, sensor)
+                    founddata += len(datapoints)
+                    readcount += 1
+                    if founddata == 0 and readcount > 5:
+                        raise Exception('device gives nonsense data')
+                    elif founddata > 0:
+                        dev.deviceErrors = 0
+                    await asyncio.sleep(0.01)
+                except Exception as e:
+                    rateLimited.info(('read', id(dev)), "Unable to read new data: %s", e)
+                    dev.deviceErrors += 1
+                    if dev.deviceErrors > 10:
+                        logging.warning("Too many errors. Removing device on Bus %d Address %d Port Number %d", dev.bus, dev.address, dev.port_number)
+                        self.devices.remove(dev)
+                    break
+            if await self.sleep(4):
+                break
+
+    async def maintenanceAsync(self):
+        for l in self.listeners:
+            if hasattr(l, 'supervise'):
+                l.supervise()
+        for datapoint, sensor in self.clusterReadings():
+            await self.dispatch(datapoint, sensor)
+        self.liveness.tick()
+        for key, datapoint, sensor in self.reception.release():
+            self.checkAlerts(key, sensor, datapoint)
+            await self.dispatch(datapoint, sensor)
+        self.publishReceptionStats()
+        rateLimited.flush()
+        self.checkConfigReload()
+        for l in [l for l in self.listenerExecutors if l not in self.listeners]:
+            self.listenerExecutors.pop(l).shutdown(wait=False)
+        if await self.runInUsb(self.checkDeviceChange):
+            await self.runInUsb(self.findDevices)
+            await self.runInUsb(self.initializeDevices)
+
+    def checkDeviceChange(self):
+        if self.lastDeviceCheck + 60 < time.time():
+            logging.debug("Checking for new Devices")
+            return self.checkForNewDevices()
+        return False
+
+    def closeListener(self, listener):
+        '''
+        async close methods run on the event loop, sync ones in the executor of the listener after the
+        readings still queued there. The executor is shut down afterwards. The close is pending, so a
+        shutdown waits for it
+        '''
+        if self.eventLoop is None:
+            if asyncio.iscoroutinefunction(listener.close):
+                asyncio.run(listener.close())
+            else:
+                listener.close()
+            return
+        if asyncio.iscoroutinefunction(listener.close):
+            future = self.eventLoop.create_task(listener.close())
+        else:
+            executor = self.executorFor(listener)
+            del self.listenerExecutors[listener]
+            future = self.eventLoop.run_in_executor(executor, listener.close)
+            executor.shutdown(wait=False)
+        self.pending.add(future)
+        future.add_done_callback(self.dispatchDone)
+
+    def executorFor(self, listener):
+        if listener not in self.listenerExecutors:
+            self.listenerExecutors[listener] = concurrent.futures.ThreadPoolExecutor(1, 'pylarexx-%s' % type(listener).__name__)
+        return self.listenerExecutors[listener]
+
+    def notifySensorStatus(self, sensor, online, lastSeen):
+        if self.eventLoop is not None:
+            self.eventLoop.call_soon_threadsafe(self.dispatchEvent, 'onSensorStatus', sensor, online, lastSeen)
+
+    def notifyAlert(self, alert):
+        if self.eventLoop is not None:
+            self.eventLoop.call_soon_threadsafe(self.dispatchEvent, 'onAlert', alert)
+
+    def notifyReceptionStats(self, rows):
+        self.dispatchEvent('onReceptionStats', rows)
+
+    def dispatchEvent(self, method, *args):
+        '''
+        passes sensor status changes, alerts and reception statistics to the listeners, in the same executors as their readings
+        '''
+        for l in self.listeners:
+            func = getattr(l, method)
+            if asyncio.iscoroutinefunction(func):
+                future = asyncio.ensure_future(func(*args))
+            else:
+                future = self.eventLoop.run_in_executor(self.executorFor(l), func, *args)
+            self.pending.add(future)
+            future.add_done_callback(self.dispatchDone)
+
+    async def dispatch(self, datapoint, sensor):
+        loop = asyncio.get_running_loop()
+        for l in self.listeners:
+            if asyncio.iscoroutinefunction(l.onNewData):
+                future = asyncio.ensure_future(l.onNewData(datapoint, sensor))
+            else:
+                future = loop.run_in_executor(self.executorFor(l), l.onNewData, datapoint, sensor)
+            self.pending.add(future)
+            future.add_done_callback(self.dispatchDone)
+        if len(self.pending) > self.MAX_PENDING:
+            await asyncio.wait(self.pending, return_when=asyncio.FIRST_COMPLETED)
+
+    def dispatchDone(self, future):
+        self.pending.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            rateLimited.error(('dispatch', type(future.exception()).__name__), "Error in DataListener: %s", future.exception())
+
+    async def callListener(self, listener, method, *args):
+        func = getattr(listener, method)
+        if asyncio.iscoroutinefunction(func):
+            return await func(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executorFor(listener), func, *args)
+
+    async def shutdownAsync(self):
+        '''
+        waits for dispatched readings, then flushes and closes all listeners within the shutdown timeout
+        '''
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.shutdownTimeout
+        await self.runInUsb(self.stopClusterReceiver)
+        for datapoint, sensor in self.clusterReadings():
+            await self.dispatch(datapoint, sensor)
+        if len(self.pending) > 0:
+            done, notDone = await asyncio.wait(self.pending, timeout=self.shutdownTimeout)
+            if len(notDone) > 0:
+                logging.error("%d readings were not handled by the DataListeners in time", len(notDone))
+        for l in self.listeners:
+            try:
+                remaining = max(0.0, deadline - loop.time())
+                if not await asyncio.wait_for(self.callListener(l, 'flush', remaining), remaining + 1):
+                    logging.error("DataListener %s did not flush all data in time", type(l).__name__)
+            except Exception as e:
+                logging.error("Error flushing DataListener %s: %s", type(l).__name__, e)
+        for l in self.listeners:
+            try:
+                await self.callListener(l, 'close')
+            except Exception as e:
+                logging.error("Error closing DataListener %s: %s", type(l).__name__, e)
+        for executor in self.listenerExecutors.values():
+            executor.shutdown(wait=False)
+        self.listeners = []
+        await self.runInUsb(self.shutdown)
+        self.usbExecutor.shutdown(wait=False)
+
+
+class AsyncRecentValuesListener(RecentValuesListener):
+    '''
+    RecentValuesListener served by the asyncio engine instead of a thread per connection.
+    The tcp port is opened with the first reading. Needs --engine asyncio.
+    '''
+
+    def openListeningPort(self):
+        # the server is started in the event loop by onNewData
+        self.starting = False
+
+    async def onNewData(self, data, sensor):
+        self.values[sensor.id] = data
+        self.sensors[sensor.id] = sensor
+        if self.server is None and not self.starting:
+            # readings are handled concurrently, only the first one starts the server
+            self.starting = True
+            host = self.params.get('host', 'localhost')
+            port = self.params.get('port', 4711)
+            logging.info("Creating async TCP server at %s:%s", host, port)
+            try:
+                self.server = await asyncio.start_server(self.handleClient, host, int(port))
+                self.ready = True
+            except Exception as e:
+                rateLimited.error(('server', port), "Unable to start TCP Server: %s", e)
+            self.starting = False
+
+    async def handleClient(self, reader, writer):
+        try:
+            writer.write(bytes(self.recentValuesText(), 'UTF-8'))
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        self.ready = False
+
+    def __del__(self):
+        pass
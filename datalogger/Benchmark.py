@@ -0,0 +1,307 @@
+'''
+Created on 19.10.2026
+
+@license: pylarexx is licensed under the Apache License, version 2, see License.txt
+
+Benchmark of the reading pipeline (pylarexx.py --benchmark): packets from a synthetic or recorded source
+are parsed, matched to sensors and passed to the outputs of the config, like in the polling loop but without
+USB devices. Time is measured per subsystem (parse, sensors, each output), memory with tracemalloc per module.
+The results can be stored as baseline, later runs fail if throughput or memory regress beyond a threshold.
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import tempfile
+import tracemalloc
+import yaml
+from datalogger.Logger import TLX00
+from datalogger.Sensor import ArexxSensorDetector
+
+
+class SyntheticSource(object):
+    '''
+    Generates USB packets like a receiver with count readings of sensors sensor ids.
+    Raw values are chosen so the readings are valid for the detected sensor type.
+    '''
+
+    TIME_OFFSET = TLX00.TIME_OFFSET
+
+    def __init__(self, count, sensors=20, seed=1):
+        self.count = count
+        self.random = random.Random(seed)
+        self.sensors = self.findSensors(sensors)
+
+    def findSensors(self, count):
+        '''
+        returns (sensorid, list of valid raw values) of count detectable sensor ids
+        '''
+        detector = ArexxSensorDetector()
+        sensors = []
+        sensorid = 10000
+        while len(sensors) < count and sensorid < 65536:
+            sensor = detector.detectDevice(sensorid)
+            sensorid += 1
+            if sensor == False:
+                continue
+            raws = [raw for raw in range(0, 65536, 64) if sensor.valmin <= sensor.rawToCooked(raw) <= sensor.valmax]
+            if len(raws) > 0:
+                sensors.append((int(sensor.id), raws))
+        if len(sensors) == 0:
+            raise ValueError('No sensors found in deviceinfo.xml')
+        return sensors
+
+    def __iter__(self):
+        start = int(time.time()) - self.TIME_OFFSET - self.count
+        produced = 0
+        while produced < self.count:
+            packet = bytearray(64)
+            pos = 0
+            # a packet holds up to 5 readings, like the packets of a TL-500
+            for n in range(min(5, self.count - produced)):
+                sensorid, raws = self.sensors[self.random.randrange(len(self.sensors))]
+                raw = self.random.choice(raws)
+                packet[pos] = 10
+                packet[pos + 1:pos + 3] = sensorid.to_bytes(2, 'little')
+                packet[pos + 3:pos + 5] = raw.to_bytes(2, 'big')
+                packet[pos + 5:pos + 9] = (start + produced).to_bytes(4, 'little')
+                packet[pos + 9] = self.random.randrange(40, 100)
+                pos += 10
+                produced += 1
+            packet[pos] = 255
+            yield packet
+
+
+class RecordedSource(object):
+    '''
+    Reads recorded USB packets from a file with one packet per line as hex string (64 bytes).
+    The packets are replayed until count readings are produced. Timestamps are moved to the present,
+    so the readings are not considered stale.
+    '''
+
+    def __init__(self, filename, count):
+        self.count = count
+        with open(filename) as f:
+            self.packets = [bytearray.fromhex(line.strip()) for line in f if len(line.strip()) > 0]
+        if len(self.packets) == 0:
+            raise ValueError('No packets in %s' % filename)
+
+    def __iter__(self):
+        parser = TLX00({'outputs': False})
+        timestamps = [d['timestamp'] for packet in self.packets for d in parser.parseData(packet)]
+        if len(timestamps) == 0:
+            return
+        span = max(timestamps) - min(timestamps) + 1
+        shift = int(time.time()) - self.count - min(timestamps)
+        produced = 0
+        while True:
+            for packet in self.packets:
+                packet = bytearray(packet)
+                readings = self.shiftTimestamps(packet, shift)
+                if readings == 0:
+                    continue
+                yield packet
+                produced += readings
+                if produced >= self.count:
+                    return
+            shift += span
+
+    def shiftTimestamps(self, packet, shift):
+        '''
+        moves the timestamps of all readings in a packet by shift seconds, returns the number of readings
+        '''
+        pos = 0
+        readings = 0
+        while pos < 64 and packet[pos] != 255:
+            size = packet[pos]
+            if size in (9, 10, 11, 12):
+                offset = pos + (5 if size < 11 else 7)
+                timestamp = int.from_bytes(packet[offset:offset + 4], 'little') + shift
+                packet[offset:offset + 4] = max(timestamp, 0).to_bytes(4, 'little')
+                readings += 1
+                pos += size
+            else:
+                pos += 1
+        return readings
+
+
+class Benchmark(object):
+    '''
+    Runs a packet source through a TLX00 pipeline. config is a parsed config file. The synthetic readings
+    must not reach real stores or servers: file and sqlite outputs of the config write to a temporary
+    directory instead, other outputs (network, tcp servers, workers) are left out. If no output is left,
+    a FileOutListener and a Sqlite3Listener are used.
+    '''
+
+    LOCAL_OUTPUTS = {'FileOutListener': 'pylarexx.out', 'Sqlite3Listener': 'pylarexx.db'}
+
+    def __init__(self, config, sourceFactory):
+        self.config = dict(config or {})
+        self.sourceFactory = sourceFactory
+        self.tmpdir = tempfile.TemporaryDirectory(prefix='pylarexx-benchmark-')
+        outputs = []
+        for n, output in enumerate(self.config.get('output') or []):
+            filename = self.LOCAL_OUTPUTS.get(output.get('type'))
+            if filename is None:
+                logging.warning("Benchmark leaves out output %s", output.get('type'))
+                continue
+            params = dict(output.get('params') or {})
+            params['filename'] = os.path.join(self.tmpdir.name, '%d-%s' % (n, filename))
+            outputs.append({'type': output['type'], 'params': params})
+        if len(outputs) == 0:
+            outputs = [{'type': name, 'params': {'filename': os.path.join(self.tmpdir.name, filename)}}
+                       for name, filename in self.LOCAL_OUTPUTS.items()]
+        self.config['output'] = outputs
+        # outputs run in this process, cluster nodes are not accepted
+        configSection = dict(self.config.get('config') or {})
+        configSection.pop('Workers', None)
+        configSection.pop('ClusterListen', None)
+        self.config['config'] = configSection
+
+    def createLogger(self):
+        logger = TLX00({})
+        logger.applyConfig(self.config)
+        return logger
+
+    def runPipeline(self, logger):
+        '''
+        returns number of readings, seconds and seconds per subsystem
+        '''
+        clock = time.perf_counter
+        subsystems = {'parse': 0.0, 'sensors': 0.0}
+        listeners = [(l, type(l).__name__) for l in logger.listeners]
+        for l, name in listeners:
+            subsystems[name] = 0.0
+        readings = 0
+        start = clock()
+        for packet in self.sourceFactory():
+            t0 = clock()
+            datapoints = logger.parseData(packet)
+            t1 = clock()
+            subsystems['parse'] += t1 - t0
+            for datapoint in datapoints:
+                t0 = clock()
+                sensor = logger.sensorForDatapoint(datapoint)
+                t1 = clock()
+                subsystems['sensors'] += t1 - t0
+                if sensor is None:
+                    continue
+                readings += 1
+                for l, name in listeners:
+                    l.onNewData(datapoint, sensor)
+                    t0 = t1
+                    t1 = clock()
+                    subsystems[name] += t1 - t0
+        t0 = clock()
+        logger.shutdown()
+        subsystems['shutdown'] = clock() - t0
+        return readings, clock() - start, subsystems
+
+    def run(self, profileFile=None):
+        '''
+        runs the pipeline three times: for timing, with tracemalloc and, if profileFile is set, with cProfile
+        '''
+        readings, seconds, subsystems = self.runPipeline(self.createLogger())
+        results = {'readings': readings, 'seconds': seconds,
+                   'readings_per_second': readings / seconds if seconds > 0 else 0.0,
+                   'subsystems': subsystems}
+
+        tracemalloc.start()
+        logger = self.createLogger()
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        self.runPipeline(logger)
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        results['peak_memory_kb'] = peak / 1024
+        results['memory_by_module_kb'] = self.memoryByModule(before, after)
+
+        if profileFile is not None:
+            import cProfile
+            profiler = cProfile.Profile()
+            logger = self.createLogger()
+            profiler.enable()
+            self.runPipeline(logger)
+            profiler.disable()
+            profiler.dump_stats(profileFile)
+            results['profile'] = profileFile
+        self.tmpdir.cleanup()
+        return results
+
+    def memoryByModule(self, before, after):
+        '''
+        allocation growth per module of pylarexx, other modules are summed up as "other"
+        '''
+        base = os.path.dirname(os.path.abspath(__file__))
+        modules = {}
+        for stat in after.compare_to(before, 'filename'):
+            filename = stat.traceback[0].filename
+            name = os.path.basename(filename) if filename.startswith(base) else 'other'
+            modules[name] = modules.get(name, 0) + stat.size_diff / 1024
+        return modules
+
+
+def compareBaseline(results, baseline, threshold):
+    '''
+    returns a list of regressions beyond threshold percent
+    '''
+    regressions = []
+    oldRate = baseline.get('readings_per_second', 0)
+    if oldRate > 0 and results['readings_per_second'] < oldRate * (1 - threshold / 100):
+        regressions.append('throughput %.0f readings/s, baseline %.0f' % (results['readings_per_second'], oldRate))
+    oldPeak = baseline.get('peak_memory_kb', 0)
+    if oldPeak > 0 and results['peak_memory_kb'] > oldPeak * (1 + threshold / 100):
+        regressions.append('peak memory %.0f kB, baseline %.0f kB' % (results['peak_memory_kb'], oldPeak))
+    return regressions
+
+
+def printResults(results, out=sys.stdout):
+    out.write('%d readings in %.2f s: %.0f readings/s, peak memory %.0f kB\n' % (
+        results['readings'], results['seconds'], results['readings_per_second'], results['peak_memory_kb']))
+    out.write('time per subsystem:\n')
+    for name, seconds in sorted(results['subsystems'].items(), key=lambda i: -i[1]):
+        out.write('  %-24s %8.3f s %6.1f us/reading\n' % (name, seconds, seconds * 1e6 / max(results['readings'], 1)))
+    out.write('allocated memory per module:\n')
+    for name, kb in sorted(results['memory_by_module_kb'].items(), key=lambda i: -i[1]):
+        out.write('  %-24s %8.0f kB\n' % (name, kb))
+    if 'profile' in results:
+        out.write('cProfile stats written to %s\n' % results['profile'])
+
+
+def benchmark(conffile, count, packets=None, profileFile=None, baselineFile=None, saveBaseline=False, threshold=20.0):
+    '''
+    runs the benchmark with sensors, calibration and outputs of conffile, if it exists.
+    Returns the exit code: 1 if a regression against the baseline was found
+    '''
+    config = {}
+    if conffile is not None and os.path.exists(conffile):
+        with open(conffile) as f:
+            config = yaml.load(f.read(), Loader=yaml.SafeLoader) or {}
+    if packets is not None:
+        def sourceFactory():
+            return iter(RecordedSource(packets, count))
+    else:
+        synthetic = SyntheticSource(count)
+
+        def sourceFactory():
+            synthetic.random.seed(1)
+            return iter(synthetic)
+    results = Benchmark(config, sourceFactory).run(profileFile)
+    printResults(results)
+    if baselineFile is None:
+        return 0
+    if saveBaseline:
+        with open(baselineFile, 'w') as f:
+            json.dump(results, f, indent=2)
+        logging.warning("Baseline written to %s", baselineFile)
+        return 0
+    with open(baselineFile) as f:
+        baseline = json.load(f)
+    regressions = compareBaseline(results, baseline, threshold)
+    for regression in regressions:
+        sys.stdout.write('REGRESSION: %s (threshold %.0f%%)\n' % (regression, threshold))
+    return 1 if len(regressions) > 0 else 0
@@ -0,0 +1,401 @@
+'''
+Created on 19.10.2026
+
+@license: pylarexx is licensed under the Apache License, version 2, see License.txt
+
+Forwards readings from edge nodes to a central pylarexx (cluster mode). Edge nodes use the output
+ClusterListener, the aggregator listens with "ClusterListen: host:port" in the config section and passes
+the readings of all nodes to its own outputs.
+
+Protocol, all numbers in network byte order. Every frame is a header (magic "PX", frame type, payload length)
+followed by the payload:
+  HELLO  edge -> aggregator  json {"version", "node", "session", "token"}
+  BATCH  edge -> aggregator  zlib compressed: first sequence number, sensor count, reading count,
+                             sensor records (ref, json length, json), readings (ref, sensorid, rawvalue,
+                             timestamp, signal). Reading n of a batch has sequence number first + n.
+  ACK    aggregator -> edge  highest sequence number received
+The edge sends one batch and waits for its ACK. Unacknowledged readings are sent again after a reconnect,
+the aggregator drops readings it already received from the same node and session.
+'''
+
+import time
+import json
+import zlib
+import uuid
+import queue
+import struct
+import socket
+import logging
+import threading
+import collections
+import socketserver
+import datalogger.Sensor
+from datalogger.DataListener import DataListener
+from datalogger.LogUtil import rateLimited
+
+PROTOCOL_VERSION = 1
+DEFAULT_PORT = 4713
+
+FRAME_HEADER = struct.Struct('!2sBI')
+FRAME_MAGIC = b'PX'
+FRAME_HELLO = 1
+FRAME_BATCH = 2
+FRAME_ACK = 3
+MAX_FRAME = 16 * 1024 * 1024
+
+BATCH_HEADER = struct.Struct('!QHI')
+SENSOR_HEADER = struct.Struct('!IH')
+READING = struct.Struct('!IIiIh')
+ACK = struct.Struct('!Q')
+
+NO_SIGNAL = -1  # signal None
+
+
+
+def intOrStr(value):
+    return value if type(value) is int else str(value)
+
+
+# attributes of the sensor classes in datalogger.Sensor that are taken from encoded sensors, with their conversion
+SENSOR_ATTRS = {'name': intOrStr, 'displayid': intOrStr, 'type': str, 'manufacturerType': str, 'unit': str,
+                'valmin': float, 'valmax': float, 'p0': float, 'p1': float, 'p2': float, 'typeWarningLogged': bool}
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def sendFrame(sock, frametype, payload):
+    sock.sendall(FRAME_HEADER.pack(FRAME_MAGIC, frametype, len(payload)) + payload)
+
+
+def recvExactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if len(chunk) == 0:
+            raise ConnectionError('connection closed')
+        data += chunk
+    return data
+
+
+def recvFrame(sock):
+    magic, frametype, size = FRAME_HEADER.unpack(recvExactly(sock, FRAME_HEADER.size))
+    if magic != FRAME_MAGIC or size > MAX_FRAME:
+        raise ProtocolError('invalid frame')
+    return frametype, recvExactly(sock, size)
+
+
+def encodeSensor(sensor):
+    return json.dumps({'class': type(sensor).__name__, 'attrs': vars(sensor)}, default=str).encode('UTF-8')
+
+
+def decodeSensor(data):
+    '''
+    creates a sensor from an encoded sensor. Only sensor classes of datalogger.Sensor are created,
+    so the sensor cooks raw values like on the edge node. Only the attributes in SENSOR_ATTRS are taken over.
+    '''
+    spec = json.loads(data.decode('UTF-8'))
+    sensorClass = getattr(datalogger.Sensor, str(spec.get('class')), None)
+    if not (isinstance(sensorClass, type) and issubclass(sensorClass, datalogger.Sensor.Sensor)):
+        sensorClass = datalogger.Sensor.Sensor
+    attrs = spec['attrs']
+    sensor = sensorClass.__new__(sensorClass)
+    datalogger.Sensor.Sensor.__init__(sensor, str(attrs['id']))
+    for name, convert in SENSOR_ATTRS.items():
+        if name in attrs:
+            setattr(sensor, name, convert(attrs[name]))
+    # json turns the integer keys of the calibration values into strings
+    sensor.calibrationValues = {int(k) if k.isdigit() else str(k): float(v)
+                                for k, v in dict(attrs.get('calibrationValues') or {}).items()}
+    return sensor
+
+
+def packReading(ref, datapoint):
+    signal = datapoint.get('signal')
+    return READING.pack(ref, int(datapoint['sensorid']), int(datapoint['rawvalue']),
+                        int(datapoint['timestamp']), NO_SIGNAL if signal is None else int(signal))
+
+
+def encodeBatch(firstseq, sensors, readings, level=6):
+    '''
+    sensors is a list of (ref, encoded sensor), readings a list of (ref, datapoint)
+    '''
+    parts = [BATCH_HEADER.pack(firstseq, len(sensors), len(readings))]
+    for ref, data in sensors:
+        parts.append(SENSOR_HEADER.pack(ref, len(data)))
+        parts.append(data)
+    for ref, datapoint in readings:
+        parts.append(packReading(ref, datapoint))
+    return zlib.compress(b''.join(parts), level)
+
+
+def decodeBatch(payload):
+    '''
+    returns first sequence number, list of (ref, sensor) and list of (ref, datapoint)
+    '''
+    data = zlib.decompress(payload)
+    firstseq, sensorcount, readingcount = BATCH_HEADER.unpack_from(data)
+    pos = BATCH_HEADER.size
+    sensors = []
+    for n in range(sensorcount):
+        ref, size = SENSOR_HEADER.unpack_from(data, pos)
+        pos += SENSOR_HEADER.size
+        sensors.append((ref, decodeSensor(data[pos:pos + size])))
+        pos += size
+    readings = []
+    for ref, sensorid, rawvalue, timestamp, signal in READING.iter_unpack(data[pos:pos + readingcount * READING.size]):
+        readings.append((ref, {'sensorid': sensorid, 'rawvalue': rawvalue, 'timestamp': timestamp,
+                               'signal': None if signal == NO_SIGNAL else signal}))
+    if len(readings) != readingcount:
+        raise ProtocolError('truncated batch')
+    return firstseq, sensors, readings
+
+
+class ClusterListener(DataListener):
+    '''
+    Edge side of cluster mode: sends all readings to an aggregator. Readings are buffered in memory
+    (params max_buffer, default 100000, oldest readings are dropped first) and sent in batches of up to
+    batch_size (default 500) readings, at least every batch_interval (default 2) seconds.
+    Params: host, port (default 4713), node (default hostname), token.
+    '''
+
+    def __init__(self, params):
+        super().__init__(params)
+        self.host = params.get('host', 'localhost')
+        self.port = int(params.get('port', DEFAULT_PORT))
+        self.node = str(params.get('node', socket.gethostname()))
+        self.token = params.get('token')
+        self.batchSize = int(params.get('batch_size', 500))
+        self.batchInterval = float(params.get('batch_interval', 2))
+        self.maxBuffer = int(params.get('max_buffer', 100000))
+        self.session = uuid.uuid4().hex
+        self.buffer = collections.deque()  # (seq, sensor, datapoint), oldest first
+        self.nextSeq = 1
+        self.refs = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.sent = threading.Condition(self.lock)
+        self.sock = None
+        self.sentSensors = {}
+        self.thread = None
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name='pylarexx-cluster', daemon=True)
+        self.thread.start()
+
+    def onNewData(self, data, sensor):
+        try:
+            packReading(0, data)
+        except (KeyError, TypeError, ValueError, struct.error) as e:
+            rateLimited.error(('cluster-reading', sensor.id), "Reading of sensor %s can not be forwarded: %s", sensor.id, e)
+            return
+        with self.lock:
+            if len(self.buffer) >= self.maxBuffer:
+                self.buffer.popleft()
+                rateLimited.error(('cluster', self.host), "Cluster buffer full. Dropping oldest readings")
+            self.buffer.append((self.nextSeq, sensor, data))
+            self.nextSeq += 1
+            if len(self.buffer) >= self.batchSize:
+                self.wakeup.set()
+
+    def run(self):
+        backoff = 1
+        while not self.stopped.is_set():
+            self.wakeup.wait(self.batchInterval)
+            self.wakeup.clear()
+            try:
+                while self.sendBatch():
+                    backoff = 1
+            except (OSError, ProtocolError, struct.error) as e:
+                rateLimited.error(('cluster', self.host), "Unable to send readings to %s:%d: %s", self.host, self.port, e)
+                self.disconnect()
+                self.stopped.wait(backoff)
+                backoff = min(backoff * 2, 60)
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=30)
+        hello = {'version': PROTOCOL_VERSION, 'node': self.node, 'session': self.session, 'token': self.token}
+        sendFrame(self.sock, FRAME_HELLO, json.dumps(hello).encode('UTF-8'))
+        self.sentSensors = {}
+        logging.info("Connected to cluster aggregator %s:%d", self.host, self.port)
+
+    def disconnect(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def sensorRef(self, sensor, sensors):
+        ref = self.refs.setdefault(sensor.id, len(self.refs))
+        sent = self.sentSensors.get(ref)
+        # reloads replace sensors and calibration dicts, the aggregator gets the sensor again
+        if sent is None or sent[0] is not sensor or sent[1] is not sensor.calibrationValues:
+            sensors.append((ref, encodeSensor(sensor)))
+            self.sentSensors[ref] = (sensor, sensor.calibrationValues)
+        return ref
+
+    def sendBatch(self):
+        '''
+        sends the oldest unacknowledged readings and waits for the ACK. Returns False if there was nothing to send.
+        '''
+        with self.lock:
+            batch = list(self.buffer)[:self.batchSize]
+        if len(batch) == 0:
+            return False
+        if self.sock is None:
+            self.connect()
+        sensors = []
+        readings = [(self.sensorRef(sensor, sensors), data) for seq, sensor, data in batch]
+        sendFrame(self.sock, FRAME_BATCH, encodeBatch(batch[0][0], sensors, readings))
+        frametype, payload = recvFrame(self.sock)
+        if frametype != FRAME_ACK:
+            raise ProtocolError('expected ACK')
+        acked = ACK.unpack(payload)[0]
+        with self.lock:
+            while len(self.buffer) > 0 and self.buffer[0][0] <= acked:
+                self.buffer.popleft()
+            self.sent.notify_all()
+        return True
+
+    def flush(self, timeout):
+        deadline = time.time() + timeout
+        self.wakeup.set()
+        with self.lock:
+            while len(self.buffer) > 0 and time.time() < deadline:
+                self.sent.wait(max(0.0, deadline - time.time()))
+            return len(self.buffer) == 0
+
+    def close(self):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(5)
+            self.thread = None
+        self.disconnect()
+        if len(self.buffer) > 0:
+            logging.error("%d readings were not sent to the cluster aggregator", len(self.buffer))
+
+
+class ClusterReceiver(object):
+    '''
+    Aggregator side of cluster mode: accepts edge nodes and puts their readings as (node, datapoint, sensor)
+    into the queue incoming, one list per batch. The polling loop takes them from there, so the outputs are
+    not called from the connection threads. A batch is acknowledged when it is queued, if the queue is full
+    the node sends it again later. Readings get the additional key "node". Sensors of different nodes are
+    separate objects.
+    '''
+
+    SESSION_TIMEOUT = 86400  # sequence numbers of sessions without batches for this long are forgotten
+
+    def __init__(self, incoming, host, port, token=None):
+        self.incoming = incoming
+        self.host = host
+        self.port = int(port)
+        self.token = token
+        self.lastSeq = {}  # (node, session) -> [highest sequence number received, time of the last batch]
+        self.lock = threading.Lock()
+        self.connections = set()
+        self.server = None
+
+    def start(self):
+        receiver = self
+
+        class ClusterRequestHandler(socketserver.BaseRequestHandler):
+
+            def handle(self):
+                receiver.handleConnection(self.request, self.client_address)
+
+        class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        logging.info("Listening for cluster nodes at %s:%d", self.host, self.port)
+        self.server = ThreadedTCPServer((self.host, self.port), ClusterRequestHandler)
+        threading.Thread(target=self.server.serve_forever, name='pylarexx-cluster-server', daemon=True).start()
+
+    def handleConnection(self, sock, address):
+        sock.settimeout(600)
+        self.connections.add(sock)
+        try:
+            frametype, payload = recvFrame(sock)
+            hello = json.loads(payload.decode('UTF-8')) if frametype == FRAME_HELLO else {}
+            if hello.get('version') != PROTOCOL_VERSION or hello.get('token') != self.token:
+                logging.error("Rejecting cluster node %s: wrong protocol version or token", address[0])
+                return
+            node = str(hello.get('node'))
+            key = (node, str(hello.get('session')))
+            logging.info("Cluster node %s connected from %s", node, address[0])
+            self.forgetSessions()
+            sensors = {}
+            while self.server is not None:
+                frametype, payload = recvFrame(sock)
+                if frametype != FRAME_BATCH:
+                    raise ProtocolError('expected BATCH')
+                firstseq, newSensors, readings = decodeBatch(payload)
+                for ref, sensor in newSensors:
+                    sensor.node = node
+                    sensors[ref] = sensor
+                acked = self.deliver(node, key, firstseq, sensors, readings)
+                sendFrame(sock, FRAME_ACK, ACK.pack(acked))
+        except (ConnectionError, socket.timeout):
+            pass
+        except Exception as e:
+            if self.server is not None:
+                rateLimited.error(('cluster', address[0]), "Error in connection from cluster node %s: %s", address[0], e)
+        finally:
+            self.connections.discard(sock)
+
+    def deliver(self, node, key, firstseq, sensors, readings):
+        '''
+        queues the new readings of a batch and returns the highest sequence number received
+        '''
+        with self.lock:
+            state = self.lastSeq.setdefault(key, [0, time.time()])
+            last = state[0]
+            if firstseq > last + 1 and last > 0:
+                rateLimited.warning(('cluster-lost', node), "Node %s dropped %d readings", node, firstseq - last - 1)
+            if self.server is None:
+                raise ConnectionError('receiver closed')
+            batch = []
+            for n, (ref, datapoint) in enumerate(readings):
+                if firstseq + n <= last:
+                    continue  # sent again after a lost ACK
+                sensor = sensors.get(ref)
+                if sensor is None:
+                    continue
+                datapoint['node'] = node
+                batch.append((node, datapoint, sensor))
+            if len(batch) > 0:
+                try:
+                    self.incoming.put_nowait(batch)
+                except queue.Full:
+                    rateLimited.warning(('cluster-full', node), "Too many readings from cluster nodes. Node %s has to wait", node)
+                    raise ConnectionError('queue full')
+            state[0] = max(last, firstseq + len(readings) - 1)
+            state[1] = time.time()
+            return state[0]
+
+    def forgetSessions(self):
+        with self.lock:
+            expired = time.time() - self.SESSION_TIMEOUT
+            for key in [key for key, state in self.lastSeq.items() if state[1] < expired]:
+                del self.lastSeq[key]
+
+    def close(self):
+        if self.server is not None:
+            server = self.server
+            self.server = None
+            server.shutdown()
+            server.server_close()
+            # unacknowledged batches are sent again to the next aggregator
+            with self.lock:
+                for sock in list(self.connections):
+                    try:
+                        sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
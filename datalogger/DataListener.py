@@ -10,31 +10,114 @@ updated on 19.01.2020
 DataListener Objects can be added to a Logger instance by configuration of "output".
 DataListener get all values from the Sensor instances through the Logger. The can write them to stdout, to file,
 serve them on a tcp socket, put them in a database (not implemented) ....
+
+Third party modules (paho-mqtt, influxdb) are imported when a listener that needs them is created,
+so only the outputs used in the config are loaded. Listeners from other packages are found by
+findListenerClass via dotted path or the "pylarexx.outputs" entry point group.
 '''
 
 import time
+import math
+import queue
+import socket
 import logging
 import socketserver
 import threading
-try:
-    import paho.mqtt.client as mqtt
-except ModuleNotFoundError:
-    logging.warn('No mqtt support')
+import importlib
 import json
 import sqlite3
-try:
-    from influxdb import InfluxDBClient
-except ModuleNotFoundError:
-    logging.warn('No influxdb support')
 from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+from datalogger.History import RingBuffer
+from datalogger.LogUtil import rateLimited
+from datalogger.Query import ROLLUP_WIDTHS, ROLLUP_TABLE, fillRollups, openStore, formatCSV, formatJSON
+from datalogger.Reception import GAP_BUCKETS
+
+ENTRY_POINT_GROUP = 'pylarexx.outputs'
+
+# listener classes found by findListenerClass, by configured type
+listenerClasses = {}
+
+
+def findListenerClass(listenerType):
+    '''
+    returns the listener class for the type of an output config. Type is the name of a class
+    in this module, a dotted path like mypackage.mymodule.MyListener or the name of an entry point
+    in the group pylarexx.outputs. Modules are imported on first use.
+    '''
+    if listenerType in listenerClasses:
+        return listenerClasses[listenerType]
+    if listenerType in globals():
+        listenerClass = globals()[listenerType]
+    elif '.' in listenerType:
+        moduleName, className = listenerType.rsplit('.', 1)
+        listenerClass = getattr(importlib.import_module(moduleName), className)
+    else:
+        listenerClass = None
+        for entryPoint in outputEntryPoints():
+            if entryPoint.name == listenerType:
+                listenerClass = entryPoint.load()
+                break
+        if listenerClass is None:
+            raise ValueError('Unknown output type %s' % listenerType)
+    if not (isinstance(listenerClass, type) and issubclass(listenerClass, DataListener)):
+        raise ValueError('Output type %s is not a DataListener' % listenerType)
+    listenerClasses[listenerType] = listenerClass
+    return listenerClass
+
+
+def outputEntryPoints():
+    from importlib import metadata
+    entryPoints = metadata.entry_points()
+    if hasattr(entryPoints, 'select'):
+        return entryPoints.select(group=ENTRY_POINT_GROUP)
+    return entryPoints.get(ENTRY_POINT_GROUP, [])
+
 
 class DataListener(object):
+    '''
+    Lifecycle: start() is called when the listener is registered, then onNewData for every reading.
+    On shutdown flush(timeout) and close() are called, close() also when the output is removed from the config.
+    '''
     def __init__(self, params):
         self.params = params
 
+    def start(self):
+        pass
+
     def onNewData(self, data, sensor):
         raise NotImplementedError
 
+    def onSensorStatus(self, sensor, online, lastSeen):
+        '''
+        called when a sensor stopped sending (online False) or sends again. lastSeen is the time of its last reading
+        '''
+        pass
+
+    def onAlert(self, alert):
+        '''
+        called when an alert rule of the config section alerts starts firing (alert['state'] 'firing') or is resolved
+        '''
+        pass
+
+    def onReceptionStats(self, rows):
+        '''
+        called periodically with the reception statistics (see datalogger.Reception) of all sensors and receivers
+        '''
+        pass
+
+    def flush(self, timeout):
+        '''
+        writes out buffered data within timeout seconds. Returns False if data are left
+        '''
+        return True
+
+    def close(self):
+        '''
+        releases files, sockets and connections
+        '''
+        pass
+
 
 class LoggingListener(DataListener):
     '''
@@ -42,13 +125,20 @@ class LoggingListener(DataListener):
     '''
 
     def onNewData(self, data, sensor):
-        logging.info("Datapoint: sensorid %s, raw data: %d cooked: %f %s timestamp: %d from sensor %s type %s" % (
-        sensor.displayid, data['rawvalue'], sensor.rawToCooked(data['rawvalue']), sensor.unit,
-        data['timestamp'], sensor.name, sensor.type))
+        if logging.getLogger().isEnabledFor(logging.INFO):
+            logging.info("Datapoint: sensorid %s, raw data: %d cooked: %f %s timestamp: %d from sensor %s type %s",
+            sensor.displayid, data['rawvalue'], sensor.rawToCooked(data['rawvalue']), sensor.unit,
+            data['timestamp'], sensor.name, sensor.type)
 
 class InfluxDBListener(DataListener):
     def __init__(self, params):
         super().__init__(params)
+        try:
+            from influxdb import InfluxDBClient
+        except ModuleNotFoundError:
+            logging.error('No influxdb support. Install the influxdb module')
+            raise
+        self.InfluxDBClient = InfluxDBClient
         self.host = self.params.get('host','127.0.0.1')
         self.port = self.params.get('port','8086')
         self.user = self.params.get('user','pi')
@@ -56,7 +146,7 @@ class InfluxDBListener(DataListener):
         self.dbname = self.params.get('dbname')
 
     def onNewData(self, data, sensor):
-        client = InfluxDBClient(self.host, self.port, self.user, self.password, self.dbname)
+        client = self.InfluxDBClient(self.host, self.port, self.user, self.password, self.dbname)
         if 'timestamp' in data:
             timestamp = datetime.utcfromtimestamp(data["timestamp"]).strftime('%Y-%m-%dT%H:%M:%SZ')
         else:
@@ -84,26 +174,61 @@ class InfluxDBListener(DataListener):
 
 class Sqlite3Listener(DataListener):
     '''
-    Listener that outputs into an sqlite database
+    Listener that outputs into an sqlite database. Besides the readings, rollups (count/sum/min/max)
+    per sensor for the bucket widths in datalogger.Query.ROLLUP_WIDTHS are maintained, so that
+    long ranges can be queried downsampled without scanning all readings.
     '''
     def __init__(self, params):
         super().__init__(params)
         self.filename = self.params.get('filename', '/tmp/pylarexx.db')
+        self.createTables()
+
+    def createTables(self):
+        try:
+            conn = sqlite3.connect(self.filename)
+            curs = conn.cursor()
+            curs.execute('''CREATE TABLE IF NOT EXISTS pylarexx (id INTEGER PRIMARY KEY, timestamp long, Location string, sensorid integer, SensorType string, SensorValue float, Unit string);''')
+            # rawvalue and rawsensorid were added later, they allow to recompute values after calibration changes
+            columns = [row[1] for row in curs.execute('''PRAGMA table_info(pylarexx);''')]
+            if 'rawvalue' not in columns:
+                curs.execute('''ALTER TABLE pylarexx ADD COLUMN rawvalue integer;''')
+            if 'rawsensorid' not in columns:
+                curs.execute('''ALTER TABLE pylarexx ADD COLUMN rawsensorid string;''')
+            curs.execute('''CREATE INDEX IF NOT EXISTS pylarexx_sensor_time ON pylarexx (sensorid, timestamp);''')
+            curs.execute('''SELECT count(*) FROM sqlite_master WHERE type='table' AND name='pylarexx_rollup';''')
+            if curs.fetchone()[0] == 0:
+                # databases of older versions get the rollups of their readings, queries only see complete rollups
+                curs.execute('''BEGIN;''')
+                curs.execute(ROLLUP_TABLE)
+                fillRollups(curs)
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logging.error("Sqlite3Listener: Unable to create tables in %s: %s", self.filename, e)
 
     def onNewData(self, data, sensor):
         conn = sqlite3.connect(self.filename)
         curs = conn.cursor()
 
-        sqlTable = '''CREATE TABLE IF NOT EXISTS pylarexx (id INTEGER PRIMARY KEY, timestamp long, Location string, sensorid integer, SensorType string, SensorValue float, Unit string);'''
-        sqlValues ='''INSERT INTO pylarexx (timestamp, Location, sensorid, SensorType, SensorValue, Unit) VALUES (?,?,?,?,?,?);'''
+        sqlValues ='''INSERT INTO pylarexx (timestamp, Location, sensorid, SensorType, SensorValue, Unit, rawvalue, rawsensorid) VALUES (?,?,?,?,?,?,?,?);'''
 
-        data_tuple = (data['timestamp'], sensor.name, sensor.displayid,sensor.type,sensor.rawToCooked(data['rawvalue']),sensor.unit)
+        value = sensor.rawToCooked(data['rawvalue'])
+        data_tuple = (data['timestamp'], sensor.name, sensor.displayid,sensor.type,value,sensor.unit,data['rawvalue'],sensor.id)
 
-        curs.execute(sqlTable)
         curs.execute(sqlValues,data_tuple)
+        self.updateRollups(curs, data['timestamp'], sensor, value)
         conn.commit()
         conn.close()
 
+    def updateRollups(self, curs, timestamp, sensor, value):
+        for width in ROLLUP_WIDTHS:
+            bucket = int(timestamp) - int(timestamp) % width
+            curs.execute('''INSERT OR IGNORE INTO pylarexx_rollup VALUES (?,?,?,?,?,0,0.0,?,?);''',
+                         (sensor.displayid, sensor.type, sensor.unit, width, bucket, value, value))
+            curs.execute('''UPDATE pylarexx_rollup SET count = count + 1, total = total + ?, minimum = min(minimum, ?), maximum = max(maximum, ?)
+                WHERE sensorid = ? AND SensorType = ? AND width = ? AND bucket = ?;''',
+                         (value, value, value, sensor.displayid, sensor.type, width, bucket))
+
 
 class FileOutListener(DataListener):
     '''
@@ -118,12 +243,11 @@ class FileOutListener(DataListener):
 
     def openLogfile(self):
         try:
-            # TODO: close file
             self.fd = open(self.filename, 'a')
             self.status = 'ready'
         except Exception as e:
             self.status = 'error'
-            logging.error("FileOutListener: Unable to open file %s. Error message: %s" % (self.filename, e))
+            rateLimited.error(('open',self.filename), "FileOutListener: Unable to open file %s. Error message: %s", self.filename, e)
 
     def onNewData(self, data, sensor):
         if self.status != 'ready':
@@ -138,8 +262,18 @@ class FileOutListener(DataListener):
             sensor.displayid, data['rawvalue'], sensor.rawToCooked(data['rawvalue']), sensor.unit,
             data['timestamp'], signaltext, sensor.name, sensor.type))
 
+    def flush(self, timeout):
+        if self.status == 'ready':
+            self.fd.flush()
+        return True
+
+    def close(self):
+        if self.status == 'ready':
+            self.fd.close()
+        self.status = 'closed'
+
     def __del__(self):
-        self.fd.close()
+        self.close()
 
 class RecentValuesListener(DataListener):
     '''
@@ -151,30 +285,34 @@ class RecentValuesListener(DataListener):
         self.values = {}
         self.sensors = {}
         self.ready = False
-        self.openListeningPort()
         self.server = None
+        self.openListeningPort()
+
+    def recentValuesText(self):
+        response = ''
+        for sid, data in list(self.values.items()):
+            sensor = self.sensors[sid]
+            if data['signal'] == None:
+                signaltext = "-"
+            else:
+                signaltext = str(data['signal'])
+            response += '%d,%f %s,%d,%s,%s,%s,%s\n' % (
+            sensor.displayid, sensor.rawToCooked(data['rawvalue']), sensor.unit, data['timestamp'],
+            signaltext, sensor.type, sensor.name, sensor.id)
+        return response
+
+    def handleRequest(self, request):
+        request.sendall(bytes(self.recentValuesText(), 'UTF-8'))
 
     def openListeningPort(self):
-        # make values visible in helper class
-        values = self.values
-        sensors = self.sensors
+        # make listener visible in helper class
+        listener = self
 
         # helper classes
         class ThreadedTCPRequestHandler(socketserver.BaseRequestHandler):
 
             def setup(self):
-                response = ''
-                for sid, data in values.items():
-                    sensor = sensors[sid]
-                    if data['signal'] == None:
-                        signaltext = "-"
-                    else:
-                        signaltext = str(data['signal'])
-                    response += '%d,%f %s,%d,%s,%s,%s,%s\n' % (
-                    sensor.displayid, sensor.rawToCooked(data['rawvalue']), sensor.unit, data['timestamp'],
-                    signaltext, sensor.type, sensor.name, sensor.id)
-
-                self.request.sendall(bytes(response, 'UTF-8'))
+                listener.handleRequest(self.request)
 
         class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
             pass
@@ -198,9 +336,292 @@ class RecentValuesListener(DataListener):
         self.sensors[sensor.id] = sensor
         if not self.ready:
             self.openListeningPort()
+
+    def onSensorStatus(self, sensor, online, lastSeen):
+        if not online and self.params.get('hide_offline', False):
+            self.values.pop(sensor.id, None)
             
+    def close(self):
+        if self.server is not None:
+            if self.ready:
+                self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        self.ready = False
+
     def __del__(self):
-        self.server.server_close()
+        self.close()
+
+
+class HistoryListener(RecentValuesListener):
+    '''
+    Listener holds the readings of the last hours from each sensor in fixed size ring buffers
+    (see datalogger.History). Memory use is bounded by max_points per sensor.
+    The tcp port answers like RecentValuesListener, if the client sends nothing. Otherwise the client
+    sends one command line:
+    stats [seconds [sensorid]]  -> displayid,type,count,min,max,mean,trend per hour,unit,name,id
+    values seconds sensorid     -> timestamp,value for all readings in the window
+    reception [sensorid]        -> displayid,receiver,readings,signal,missed,loss,interval,best,type,name,id
+                                   receiver * is the sensor over all receivers
+    '''
+
+    def __init__(self, params):
+        self.history = {}
+        self.historyLock = threading.Lock()
+        hours = float(params.get('hours', 24))
+        interval = float(params.get('interval', 60))  # expected seconds between two readings of a sensor
+        self.maxPoints = int(params.get('max_points', math.ceil(hours * 3600 / interval)))
+        self.commandTimeout = float(params.get('command_timeout', 0.5))
+        self.reception = []
+        super().__init__(params)
+
+    def onNewData(self, data, sensor):
+        value = sensor.rawToCooked(data['rawvalue'])
+        # commands look up the sensors of the history, so the sensor is registered first
+        super().onNewData(data, sensor)
+        with self.historyLock:
+            if sensor.id not in self.history:
+                self.history[sensor.id] = RingBuffer(self.maxPoints)
+            self.history[sensor.id].append(data['timestamp'], value)
+
+    def onReceptionStats(self, rows):
+        self.reception = rows
+
+    def handleRequest(self, request):
+        request.settimeout(self.commandTimeout)
+        try:
+            command = request.makefile('r').readline().split()
+        except socket.timeout:
+            command = []
+        request.settimeout(None)
+        if len(command) == 0:
+            super().handleRequest(request)
+            return
+        try:
+            response = self.answerCommand(command)
+        except (ValueError, IndexError, KeyError) as e:
+            response = 'error: %s\n' % e
+        request.sendall(bytes(response, 'UTF-8'))
+
+    def answerCommand(self, command):
+        if command[0] == 'reception':
+            response = ''
+            for row in self.reception:
+                if len(command) > 1 and str(row['displayid']) != command[1] and row['sensorid'] != command[1]:
+                    continue
+                response += '%s,%s,%d,%s,%d,%f,%s,%d,%s,%s,%s\n' % (
+                    row['displayid'], '*' if row['receiver'] is None else row['receiver'], row['readings'],
+                    '-' if row['signal'] is None else '%.1f' % row['signal'], row['missed'], row['loss'],
+                    '-' if row['interval'] is None else '%.1f' % row['interval'], row['best'],
+                    row['type'], row['name'], row['sensorid'])
+            return response
+        seconds = float(command[1]) if len(command) > 1 else None
+        since = None if seconds is None else time.time() - seconds
+        if command[0] == 'stats':
+            response = ''
+            for sid in list(self.history.keys()):
+                sensor = self.sensors[sid]
+                if len(command) > 2 and str(sensor.displayid) != command[2] and sid != command[2]:
+                    continue
+                with self.historyLock:
+                    stats = self.history[sid].stats(since)
+                if stats is None:
+                    continue
+                response += '%s,%s,%d,%f,%f,%f,%f,%s,%s,%s\n' % (
+                    sensor.displayid, sensor.type, stats['count'], stats['min'], stats['max'], stats['mean'],
+                    stats['trend'], sensor.unit, sensor.name, sensor.id)
+            return response
+        if command[0] == 'values':
+            response = ''
+            for sid in list(self.history.keys()):
+                sensor = self.sensors[sid]
+                if str(sensor.displayid) != command[2] and sid != command[2]:
+                    continue
+                with self.historyLock:
+                    timestamps, values = self.history[sid].window(since)
+                for t, v in zip(timestamps, values):
+                    response += '%d,%f\n' % (t, v)
+            return response
+        raise ValueError('unknown command %s' % command[0])
+
+
+class HttpQueryListener(DataListener):
+    '''
+    Listener that answers range queries over stored readings via http. It does not handle new data itself,
+    it reads the database written by a Sqlite3Listener with the same filename. Example queries:
+    /sensors
+    /query?sensor=17208&from=1577833200&to=1577919600&points=200&format=csv
+    /metrics
+    from/to are unix timestamps (default: the last 24 hours), type selects one SensorType of a multi sensor
+    and format is json (default) or csv. Results are streamed row by row.
+    /metrics gives online state, last reading and reading count of the sensors and the reception statistics
+    per sensor and receiver in prometheus text format.
+    '''
+
+    def __init__(self, params):
+        super().__init__(params)
+        self.sensorStatus = {}  # sensor id -> [sensor, online, last seen, readings]
+        self.reception = []
+        self.server = None
+        self.ready = False
+        self.openListeningPort()
+
+    def openListeningPort(self):
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+
+        # make params and listener visible in helper class
+        params = self.params
+        listener = self
+
+        class QueryRequestHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                if url.path == '/metrics':
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    self.end_headers()
+                    self.wfile.write(bytes(listener.metricsText(), 'UTF-8'))
+                    return
+                try:
+                    store = openStore(params)
+                except Exception as e:
+                    self.send_error(500, 'Unable to open store: %s' % e)
+                    return
+                headersSent = False
+                try:
+                    if url.path == '/sensors':
+                        rows = store.sensors()
+                    elif url.path == '/query' and 'sensor' in query:
+                        end = int(query.get('to', time.time()))
+                        start = int(query.get('from', end - 86400))
+                        points = query.get('points')
+                        rows = store.query(int(query['sensor']), start, end,
+                                           None if points is None else int(points), query.get('type'))
+                    else:
+                        self.send_error(404, 'Use /sensors, /metrics or /query?sensor=<id>')
+                        return
+                    if query.get('format', 'json') == 'csv':
+                        contentType = 'text/csv'
+                        lines = formatCSV(rows)
+                    else:
+                        contentType = 'application/json'
+                        lines = formatJSON(rows)
+                    first = next(lines)  # run the query before sending the header, so errors give a 400
+                    self.send_response(200)
+                    self.send_header('Content-Type', contentType)
+                    self.end_headers()
+                    headersSent = True
+                    self.wfile.write(bytes(first, 'UTF-8'))
+                    for line in lines:
+                        self.wfile.write(bytes(line, 'UTF-8'))
+                except ValueError as e:
+                    self.send_error(400, str(e))
+                except Exception as e:
+                    logging.error("HttpQueryListener: error answering %s: %s", self.path, e)
+                    # after the header only the connection can be closed
+                    if not headersSent:
+                        self.send_error(500, str(e))
+                finally:
+                    store.close()
+
+            def log_message(self, format, *args):
+                logging.debug("HttpQueryListener: " + format, *args)
+
+        class ThreadedHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        try:
+            host = self.params.get('host', 'localhost')
+            port = self.params.get('port', 4712)
+            logging.info("Creating HTTP query server at %s:%s" % (host, port))
+            self.server = ThreadedHTTPServer((host, int(port)), QueryRequestHandler)
+            server_thread = threading.Thread(target=self.server.serve_forever)
+            server_thread.daemon = True
+            server_thread.start()
+            self.ready = True
+        except Exception as e:
+            logging.error("Unable to start HTTP query server: %s", e)
+
+    def metricsText(self):
+        online = ['# TYPE pylarexx_sensor_online gauge']
+        lastSeen = ['# TYPE pylarexx_sensor_last_seen_seconds gauge']
+        readings = ['# TYPE pylarexx_sensor_readings_total counter']
+        for sensor, isOnline, seen, count in list(self.sensorStatus.values()):
+            labels = 'sensor="%s",displayid="%s",name="%s",type="%s"' % tuple(
+                str(v).replace('\\', '\\\\').replace('"', '\\"')
+                for v in (sensor.id, sensor.displayid, sensor.name, sensor.type))
+            online.append('pylarexx_sensor_online{%s} %d' % (labels, isOnline))
+            lastSeen.append('pylarexx_sensor_last_seen_seconds{%s} %d' % (labels, seen))
+            readings.append('pylarexx_sensor_readings_total{%s} %d' % (labels, count))
+        return '\n'.join(online + lastSeen + readings + self.receptionMetrics()) + '\n'
+
+    def receptionMetrics(self):
+        '''
+        rows with receiver None are the sensor over all receivers, the others get a receiver label
+        '''
+        missed = ['# TYPE pylarexx_sensor_missed_total counter']
+        loss = ['# TYPE pylarexx_sensor_loss_ratio gauge']
+        received = ['# TYPE pylarexx_reception_readings_total counter']
+        signal = ['# TYPE pylarexx_reception_signal gauge']
+        receiverMissed = ['# TYPE pylarexx_reception_missed_total counter']
+        receiverLoss = ['# TYPE pylarexx_reception_loss_ratio gauge']
+        best = ['# TYPE pylarexx_reception_best_receiver gauge']
+        gaps = ['# TYPE pylarexx_reception_gap_seconds histogram']
+        for row in self.reception:
+            labels = 'sensor="%s",displayid="%s",name="%s",type="%s"' % tuple(
+                str(v).replace('\\', '\\\\').replace('"', '\\"')
+                for v in (row['sensorid'], row['displayid'], row['name'], row['type']))
+            if row['receiver'] is None:
+                missed.append('pylarexx_sensor_missed_total{%s} %d' % (labels, row['missed']))
+                loss.append('pylarexx_sensor_loss_ratio{%s} %f' % (labels, row['loss']))
+                continue
+            labels += ',receiver="%s"' % str(row['receiver']).replace('\\', '\\\\').replace('"', '\\"')
+            received.append('pylarexx_reception_readings_total{%s} %d' % (labels, row['readings']))
+            if row['signal'] is not None:
+                signal.append('pylarexx_reception_signal{%s} %f' % (labels, row['signal']))
+            receiverMissed.append('pylarexx_reception_missed_total{%s} %d' % (labels, row['missed']))
+            receiverLoss.append('pylarexx_reception_loss_ratio{%s} %f' % (labels, row['loss']))
+            best.append('pylarexx_reception_best_receiver{%s} %d' % (labels, row['best']))
+            count = 0
+            for bound, n in zip(list(GAP_BUCKETS) + ['+Inf'], row['gaps']):
+                count += n
+                gaps.append('pylarexx_reception_gap_seconds_bucket{%s,le="%s"} %d' % (labels, bound, count))
+            gaps.append('pylarexx_reception_gap_seconds_sum{%s} %d' % (labels, row['gap_sum']))
+            gaps.append('pylarexx_reception_gap_seconds_count{%s} %d' % (labels, count))
+        return missed + loss + received + signal + receiverMissed + receiverLoss + best + gaps
+
+    def onNewData(self, data, sensor):
+        status = self.sensorStatus.get(sensor.id)
+        if status is None:
+            self.sensorStatus[sensor.id] = [sensor, True, time.time(), 1]
+        else:
+            status[0] = sensor
+            status[1] = True
+            status[2] = time.time()
+            status[3] += 1
+        if not self.ready:
+            self.openListeningPort()
+
+    def onSensorStatus(self, sensor, online, lastSeen):
+        status = self.sensorStatus.get(sensor.id)
+        if status is not None:
+            status[1] = online
+
+    def onReceptionStats(self, rows):
+        self.reception = rows
+
+    def close(self):
+        if self.server is not None:
+            if self.ready:
+                self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        self.ready = False
+
+    def __del__(self):
+        self.close()
 
 
 class MQTTListener(DataListener):
@@ -218,17 +639,45 @@ class MQTTListener(DataListener):
 
     def __init__(self, params):
         super().__init__(params)
+        try:
+            import paho.mqtt.client as mqtt
+        except ModuleNotFoundError:
+            logging.error('No mqtt support. Install the paho-mqtt module')
+            raise
         self.mqttClient = mqtt.Client()
+        self.lastMessage = None
         self.values = {}
         self.ready = False
         self.connect()
 
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.lastMessage = self.mqttClient.publish(topic, payload, qos, retain)
+        return self.lastMessage
+
+    def flush(self, timeout):
+        '''
+        messages are sent in order, so waiting for the last one is enough
+        '''
+        if not self.ready or self.lastMessage is None:
+            return True
+        try:
+            self.lastMessage.wait_for_publish(timeout)
+        except Exception as e:
+            logging.error("Error flushing mqtt messages: %s", e)
+        return self.lastMessage.is_published()
+
+    def close(self):
+        if self.ready:
+            self.mqttClient.loop_stop()
+            self.mqttClient.disconnect()
+        self.ready = False
+
     def on_connect(self, client, userdata, flags, rc):
         logging.info("Connected to mqtt broker with result code %d", rc)
         # Subscribe to anything? Not at the moment.
 
     def on_message(self, client, userdata, msg):
-        logging.debug("Got message from mqtt broker: %s / %s", (msg.topic, msg.payload))
+        logging.debug("Got message from mqtt broker: %s / %s", msg.topic, msg.payload)
 
     def connect(self):
 
@@ -265,6 +714,7 @@ class MQTTListener(DataListener):
                 topicroot, self.params.get('mqtt_device', 'pylarexx'), sensor.displayid)
                 topicstate = '%s/%s_%s/state' % (
                 topicroot, self.params.get('mqtt_device', 'pylarexx'), sensor.displayid)
+                topicavailability = self.availabilityTopic(sensor)
 
                 if newSensor:
                     logging.debug('New Sensor config')
@@ -281,12 +731,43 @@ class MQTTListener(DataListener):
                                'state_topic': topicstate,
                                'unit_of_measurement': unit_of_measurement,
                                'value_template': '{{value_json.%s}}' % stype,
+                               'availability_topic': topicavailability,
                                }
-                    self.mqttClient.publish(topicconfig, json.dumps(payload), 0, True)
+                    self.publish(topicconfig, json.dumps(payload), 0, True)
+                    self.publish(topicavailability, 'online', 0, True)
                 statePayload = {}
                 statePayload[sensor.type.lower()] = '%.2f' % sensor.rawToCooked(data['rawvalue'])
-                self.mqttClient.publish(topicstate, json.dumps(statePayload))
+                self.publish(topicstate, json.dumps(statePayload))
+
+            except Exception as e:
+                logging.error("Error publishing mqtt messages: %s", e)
+
+    def availabilityTopic(self, sensor):
+        return '%s/sensor/%s_%s/availability' % (self.params.get('mqtt_base_topic', 'homeassistant'),
+                                                 self.params.get('mqtt_device', 'pylarexx'), sensor.displayid)
+
+    def onSensorStatus(self, sensor, online, lastSeen):
+        '''
+        home assistant shows sensors as unavailable while they are offline
+        '''
+        if self.ready and self.params.get('payload_format', 'home-assistant') == 'home-assistant':
+            try:
+                self.publish(self.availabilityTopic(sensor), 'online' if online else 'offline', 0, True)
+            except Exception as e:
+                logging.error("Error publishing mqtt messages: %s", e)
 
+    def onAlert(self, alert):
+        '''
+        with param alert_topic, alerts are published retained as json to <alert_topic>/<rule name>,
+        alerts of cluster nodes to <alert_topic>/<node>/<rule name>
+        '''
+        topic = self.params.get('alert_topic')
+        if self.ready and topic:
+            try:
+                if 'node' in alert:
+                    topic = '%s/%s' % (topic, alert['node'])
+                rule = alert['rule'].replace('/', '_').replace('+', '_').replace('#', '_')
+                self.publish('%s/%s' % (topic, rule), json.dumps(alert), 1, True)
             except Exception as e:
                 logging.error("Error publishing mqtt messages: %s", e)
 
@@ -302,55 +783,112 @@ class MQTTListener(DataListener):
                 topicroot = '%s/%s' % (
                 self.params.get('mqtt_base_topic', 'homie'), self.params.get('mqtt_device', 'pylarexx'))
 
-                logging.debug("publishing MQTT messages with topic root %s" % topicroot)
+                logging.debug("publishing MQTT messages with topic root %s", topicroot)
                 if newSensor:
                     logging.debug("Updating MQTT device")
-                    self.mqttClient.publish('%s/$homie' % topicroot, self.params.get('homie_convention_version', '3.0'),
+                    self.publish('%s/$homie' % topicroot, self.params.get('homie_convention_version', '3.0'),
                                             0, True)
-                    self.mqttClient.publish('%s/$name' % topicroot, self.params.get('mqtt_device_name',
+                    self.publish('%s/$name' % topicroot, self.params.get('mqtt_device_name',
                                                                                     'Python MQTT Adapter for Arexx Multilogger'),
                                             0, True)
                     nodes = []
                     for sid, value in self.values.items():
                         nodes.append('sensor_%d' % sid)
                     nodestring = ','.join(nodes)
-                    self.mqttClient.publish('%s/$nodes' % topicroot, nodestring, 0, True)  # does this work?
-                    self.mqttClient.publish('%s/$state' % topicroot, "ready", 0, True)
+                    self.publish('%s/$nodes' % topicroot, nodestring, 0, True)  # does this work?
+                    self.publish('%s/$state' % topicroot, "ready", 0, True)
 
                     for sid, value in self.values.items():
                         logging.debug("Sending MQTT sensor values")
-                        self.mqttClient.publish('%s/sensor_%d/$type' % (topicroot, sid),
+                        self.publish('%s/sensor_%d/$type' % (topicroot, sid),
                                                 value['sensor'].manufacturerType)
-                        self.mqttClient.publish('%s/sensor_%d/$name' % (topicroot, sid), value['sensor'].name)
-                        self.mqttClient.publish('%s/sensor_%d/$properties' % (topicroot, sid),
+                        self.publish('%s/sensor_%d/$name' % (topicroot, sid), value['sensor'].name)
+                        self.publish('%s/sensor_%d/$properties' % (topicroot, sid),
                                                 value['sensor'].type.lower())
-                        self.mqttClient.publish(
+                        self.publish(
                             '%s/sensor_%d/%s/$name' % (topicroot, sid, value['sensor'].type.lower()),
                             '%s %s' % (value['sensor'].name, value['sensor'].type))
-                        self.mqttClient.publish(
+                        self.publish(
                             '%s/sensor_%d/%s/$datatype' % (topicroot, sid, value['sensor'].type.lower()), 'float')
-                        self.mqttClient.publish(
+                        self.publish(
                             '%s/sensor_%d/%s/$unit' % (topicroot, sid, value['sensor'].type.lower()),
                             value['sensor'].unit)
-                        self.mqttClient.publish('%s/sensor_%d/%s' % (topicroot, sid, value['sensor'].type.lower()),
+                        self.publish('%s/sensor_%d/%s' % (topicroot, sid, value['sensor'].type.lower()),
                                                 '%.2f' % value['sensor'].rawToCooked(value['rawvalue']))
                 else:
                     logging.debug("Sending MQTT sensor values")
                     sid = sensor.displayid
-                    self.mqttClient.publish('%s/sensor_%d/$type' % (topicroot, sid), sensor.manufacturerType)
-                    self.mqttClient.publish('%s/sensor_%d/$name' % (topicroot, sid), sensor.name)
-                    self.mqttClient.publish('%s/sensor_%d/$properties' % (topicroot, sid), sensor.type.lower())
-                    self.mqttClient.publish('%s/sensor_%d/%s/$name' % (topicroot, sid, sensor.type.lower()),
+                    self.publish('%s/sensor_%d/$type' % (topicroot, sid), sensor.manufacturerType)
+                    self.publish('%s/sensor_%d/$name' % (topicroot, sid), sensor.name)
+                    self.publish('%s/sensor_%d/$properties' % (topicroot, sid), sensor.type.lower())
+                    self.publish('%s/sensor_%d/%s/$name' % (topicroot, sid, sensor.type.lower()),
                                             '%s %s' % (sensor.name, sensor.type))
-                    self.mqttClient.publish('%s/sensor_%d/%s/$datatype' % (topicroot, sid, sensor.type.lower()),
+                    self.publish('%s/sensor_%d/%s/$datatype' % (topicroot, sid, sensor.type.lower()),
                                             'float')
-                    self.mqttClient.publish('%s/sensor_%d/%s/$unit' % (topicroot, sid, sensor.type.lower()),
+                    self.publish('%s/sensor_%d/%s/$unit' % (topicroot, sid, sensor.type.lower()),
                                             sensor.unit)
-                    self.mqttClient.publish('%s/sensor_%d/%s' % (topicroot, sid, sensor.type.lower()),
+                    self.publish('%s/sensor_%d/%s' % (topicroot, sid, sensor.type.lower()),
                                             '%.2f' % sensor.rawToCooked(data['rawvalue']))
             except Exception as e:
                 logging.error("Error publishing mqtt messages: %s", e)
 
 
+class WebhookListener(DataListener):
+    '''
+    Posts alerts as json to the url in params, readings are not sent. Requests are sent by a thread, so a slow
+    endpoint does not delay the polling. Alerts are dropped if more than queue_size (default 1000) are waiting.
+    '''
 
+    def __init__(self, params):
+        super().__init__(params)
+        import urllib.request
+        self.urllib = urllib.request
+        self.url = params['url']
+        self.timeout = float(params.get('timeout', 5))
+        self.headers = dict(params.get('headers') or {})
+        self.headers.setdefault('Content-Type', 'application/json')
+        self.alerts = queue.Queue(int(params.get('queue_size', 1000)))
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.sendAlerts, name='pylarexx-webhook', daemon=True)
+        self.thread.start()
 
+    def onNewData(self, data, sensor):
+        pass
+
+    def onAlert(self, alert):
+        try:
+            self.alerts.put_nowait(alert)
+        except queue.Full:
+            rateLimited.error(('webhook', self.url), "Too many alerts waiting for %s. Dropping alert %s", self.url, alert['rule'])
+
+    def sendAlerts(self):
+        while True:
+            alert = self.alerts.get()
+            try:
+                if alert is None:
+                    return
+                request = self.urllib.Request(self.url, json.dumps(alert).encode('UTF-8'), self.headers)
+                with self.urllib.urlopen(request, timeout=self.timeout) as response:
+                    response.read()
+            except Exception as e:
+                rateLimited.error(('webhook', self.url), "Unable to send alert to %s: %s", self.url, e)
+            finally:
+                self.alerts.task_done()
+
+    def flush(self, timeout):
+        deadline = time.time() + timeout
+        while self.alerts.unfinished_tasks > 0 and time.time() < deadline:
+            time.sleep(0.05)
+        return self.alerts.unfinished_tasks == 0
+
+    def close(self):
+        if self.thread is not None:
+            try:
+                self.alerts.put_nowait(None)
+            except queue.Full:
+                # the endpoint hangs, the daemon thread is left behind with the remaining alerts
+                logging.error("Dropping %d alerts for %s", self.alerts.qsize(), self.url)
+            self.thread.join(self.timeout)
+            self.thread = None
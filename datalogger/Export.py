@@ -0,0 +1,144 @@
+'''
+Created on 19.10.2026
+
+@license: pylarexx is licensed under the Apache License, version 2, see License.txt
+
+Exports stored readings (pylarexx.py --export FORMAT). Readings are read from a store and formatted by
+generators, so memory use does not depend on the number of readings. Formats:
+csv, jsonl (one json object per line), influx (line protocol, e.g. for "influx write") and
+parquet (needs pyarrow, written in row groups of chunksize readings).
+'''
+
+import sys
+import json
+import logging
+from datalogger.Query import READING_FIELDS, Sqlite3Store, FileStore, formatCSV
+
+FORMATS = ('csv', 'jsonl', 'influx', 'parquet')
+
+
+def openExportStore(filename):
+    '''
+    returns a Sqlite3Store for sqlite databases, a FileStore for other files
+    '''
+    with open(filename, 'rb') as f:
+        header = f.read(16)
+    if header == b'SQLite format 3\x00':
+        return Sqlite3Store(filename)
+    return FileStore(filename)
+
+
+def formatJSONLines(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def escapeTag(value):
+    return str(value).replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+def formatInflux(rows, measurement='arexx'):
+    '''
+    influx line protocol with the tags and fields written by InfluxDBListener, timestamps in nanoseconds
+    '''
+    measurement = escapeTag(measurement)
+    for row in rows:
+        if row['value'] is None:
+            continue
+        yield '%s,Location=%s,SensorType=%s,Unit=%s,sensorid=%s SensorValue=%r %d\n' % (
+            measurement, escapeTag(row['name']), escapeTag(row['type']), escapeTag(row['unit']),
+            escapeTag(row['sensorid']), float(row['value']), int(row['timestamp']) * 1000000000)
+
+
+def writeParquet(rows, out, chunksize):
+    '''
+    writes the rows to a parquet file in row groups of chunksize rows. out is a filename or a binary file
+    '''
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ModuleNotFoundError:
+        raise ValueError('parquet export needs pyarrow, install it with "pip install pyarrow"')
+    schema = pyarrow.schema([('timestamp', pyarrow.int64()), ('sensorid', pyarrow.int64()), ('name', pyarrow.string()),
+                             ('type', pyarrow.string()), ('unit', pyarrow.string()), ('value', pyarrow.float64()),
+                             ('rawvalue', pyarrow.int64()), ('rawsensorid', pyarrow.string()), ('signal', pyarrow.int64())])
+    count = 0
+    with pyarrow.parquet.ParquetWriter(out, schema) as writer:
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunksize:
+                writer.write_batch(pyarrow.RecordBatch.from_pylist(chunk, schema=schema))
+                count += len(chunk)
+                chunk = []
+        if len(chunk) > 0:
+            writer.write_batch(pyarrow.RecordBatch.from_pylist(chunk, schema=schema))
+            count += len(chunk)
+    return count
+
+
+def counted(rows, counter):
+    for row in rows:
+        counter[0] += 1
+        yield row
+
+
+def exportReadings(store, exportFormat, out, sensorids=None, start=0, end=2**32, chunksize=10000):
+    '''
+    writes the readings of a store to out, a text file (binary file or filename for parquet).
+    Returns the number of exported readings.
+    '''
+    if exportFormat not in FORMATS:
+        raise ValueError('Unknown export format %s, use one of %s' % (exportFormat, ', '.join(FORMATS)))
+    rows = store.readings(sensorids, start, end)
+    if exportFormat == 'parquet':
+        return writeParquet(rows, out, chunksize)
+    counter = [0]
+    rows = counted(rows, counter)
+    if exportFormat == 'csv':
+        lines = formatCSV(rows, READING_FIELDS)
+    elif exportFormat == 'jsonl':
+        lines = formatJSONLines(rows)
+    else:
+        lines = formatInflux(rows)
+    for line in lines:
+        out.write(line)
+    return counter[0]
+
+
+def export(config, exportFormat, storeFile=None, outFile='-', sensorids=None, start=0, end=2**32, chunksize=10000):
+    '''
+    exports from storeFile or, if not given, from the first Sqlite3Listener or FileOutListener output of config.
+    Writes to outFile, "-" is stdout. Returns the exit code
+    '''
+    if storeFile is None:
+        defaults = {'Sqlite3Listener': '/tmp/pylarexx.db', 'FileOutListener': '/tmp/pylarexx.out'}
+        for output in config.get('output') or []:
+            if output.get('type') in defaults:
+                storeFile = (output.get('params') or {}).get('filename', defaults[output.get('type')])
+                break
+    if storeFile is None:
+        logging.error("No store to export. Use --store or configure a Sqlite3Listener or FileOutListener output")
+        return 2
+    store = openExportStore(storeFile)
+    try:
+        if exportFormat == 'parquet':
+            out = sys.stdout.buffer if outFile == '-' else outFile
+            count = exportReadings(store, exportFormat, out, sensorids, start, end, chunksize)
+        elif outFile == '-':
+            count = exportReadings(store, exportFormat, sys.stdout, sensorids, start, end, chunksize)
+            sys.stdout.flush()
+        else:
+            with open(outFile, 'w') as out:
+                count = exportReadings(store, exportFormat, out, sensorids, start, end, chunksize)
+    except ValueError as e:
+        logging.error("Export failed: %s", e)
+        return 2
+    except BrokenPipeError:
+        # the reading end of the pipe stopped early, e.g. head
+        sys.stdout = None
+        return 1
+    finally:
+        store.close()
+    logging.info("Exported %d readings from %s", count, storeFile)
+    return 0
@@ -0,0 +1,128 @@
+'''
+Created on 19.10.2026
+
+@license: pylarexx is licensed under the Apache License, version 2, see License.txt
+
+Fixed size in-memory history of sensor readings. Each RingBuffer preallocates its arrays,
+so memory use is capacity * 16 bytes per sensor, no matter how long pylarexx runs.
+'''
+
+import array
+
+
+class RingBuffer(object):
+    '''
+    Holds the last capacity (timestamp, value) pairs ordered by timestamp, window lookups use a binary search
+    over the timestamps. Timestamps are expected to arrive mostly in order, older ones (e.g. from the flash
+    backlog of a receiver) are inserted at their place.
+    '''
+
+    def __init__(self, capacity):
+        self.capacity = max(1, int(capacity))
+        self.timestamps = array.array('d', [0.0]) * self.capacity
+        self.values = array.array('d', [0.0]) * self.capacity
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, value):
+        '''
+        if the buffer is full, the oldest entry is dropped. An entry older than all entries of a full buffer is dropped itself.
+        '''
+        if self.count > 0 and timestamp < self.last()[0]:
+            self.insert(timestamp, value)
+            return
+        pos = (self.start + self.count) % self.capacity
+        self.timestamps[pos] = timestamp
+        self.values[pos] = value
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+
+    def insert(self, timestamp, value):
+        '''
+        inserts an entry older than the last one. The entries on the shorter side are moved by one place.
+        '''
+        index = self.firstIndexSince(timestamp)
+        if self.count == self.capacity:
+            if index == 0:
+                return
+            # the oldest entry is dropped, the entries before index move down
+            for i in range(index - 1):
+                self.move(i + 1, i)
+            index -= 1
+        else:
+            for i in range(self.count - 1, index - 1, -1):
+                self.move(i, i + 1)
+            self.count += 1
+        pos = (self.start + index) % self.capacity
+        self.timestamps[pos] = timestamp
+        self.values[pos] = value
+
+    def move(self, source, target):
+        '''
+        copies the entry at logical index source to logical index target
+        '''
+        source = (self.start + source) % self.capacity
+        target = (self.start + target) % self.capacity
+        self.timestamps[target] = self.timestamps[source]
+        self.values[target] = self.values[source]
+
+    def last(self):
+        if self.count == 0:
+            return None
+        pos = (self.start + self.count - 1) % self.capacity
+        return self.timestamps[pos], self.values[pos]
+
+    def firstIndexSince(self, since):
+        '''
+        logical index of the first entry with timestamp >= since
+        '''
+        lo = 0
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamps[(self.start + mid) % self.capacity] < since:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def window(self, since=None):
+        '''
+        returns (timestamps, values) arrays of all entries with timestamp >= since
+        '''
+        first = 0 if since is None else self.firstIndexSince(since)
+        begin = (self.start + first) % self.capacity
+        end = begin + self.count - first
+        if end <= self.capacity:
+            return self.timestamps[begin:end], self.values[begin:end]
+        end -= self.capacity
+        return self.timestamps[begin:] + self.timestamps[:end], self.values[begin:] + self.values[:end]
+
+    def stats(self, since=None):
+        '''
+        returns count, min, max, mean and trend (least squares slope in value per hour) of a window.
+        Returns None for an empty window.
+        '''
+        timestamps, values = self.window(since)
+        n = len(values)
+        if n == 0:
+            return None
+        mean = sum(values) / n
+        trend = 0.0
+        if n > 1:
+            t0 = timestamps[0]
+            tmean = sum(timestamps) / n - t0
+            sxx = 0.0
+            sxy = 0.0
+            for t, v in zip(timestamps, values):
+                dt = t - t0 - tmean
+                sxx += dt * dt
+                sxy += dt * (v - mean)
+            if sxx > 0:
+                trend = sxy / sxx * 3600
+        return {'count': n, 'min': min(values), 'max': max(values), 'mean': mean, 'trend': trend}
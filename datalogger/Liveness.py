@@ -0,0 +1,138 @@
+'''
+Created on 19.10.2026
+
+@license: pylarexx is licensed under the Apache License, version 2, see License.txt
+
+Detects sensors that stopped sending. Every sensor has a deadline: the time of its last reading plus
+a multiple of its transmit interval, which is learned from the timestamps of its readings. Deadlines
+are kept in a timer wheel, so a reading only updates the deadline of its sensor and a tick only looks
+at the timers that expire, no matter how many sensors are tracked.
+'''
+
+import time
+import logging
+import threading
+
+
+class TimerWheel(object):
+    '''
+    Hashed timer wheel with slots of resolution seconds. Timers further away than one revolution
+    stay in their slot and are skipped until their round comes.
+    '''
+
+    def __init__(self, resolution=5, slots=720, now=None):
+        self.resolution = resolution
+        self.slots = [dict() for n in range(slots)]
+        self.current = int((time.time() if now is None else now) // resolution)
+
+    def add(self, key, deadline):
+        '''
+        returns the tick of the timer, which is needed to remove it
+        '''
+        tick = max(int(deadline // self.resolution), self.current + 1)
+        self.slots[tick % len(self.slots)][key] = tick
+        return tick
+
+    def remove(self, key, tick):
+        self.slots[tick % len(self.slots)].pop(key, None)
+
+    def advance(self, now):
+        '''
+        returns the keys of all timers that expired up to now
+        '''
+        expired = []
+        last = int(now // self.resolution)
+        # after a long pause every slot is visited once
+        if last - self.current > len(self.slots):
+            self.current = last - len(self.slots)
+        while self.current < last:
+            self.current += 1
+            slot = self.slots[self.current % len(self.slots)]
+            for key, tick in list(slot.items()):
+                if tick <= self.current:
+                    del slot[key]
+                    expired.append(key)
+        return expired
+
+
+class LivenessTracker(object):
+    '''
+    Tracks last seen times of sensors and calls callback(sensor, online, lastSeen) when a sensor goes
+    offline (no reading for factor times its interval, at least minimum seconds) or comes back.
+    The interval starts at interval seconds and follows the observed cadence.
+    '''
+
+    ALPHA = 0.2  # weight of a new observed interval
+
+    def __init__(self, callback, interval=60, factor=3, minimum=300):
+        self.callback = callback
+        self.interval = float(interval)
+        self.factor = float(factor)
+        self.minimum = float(minimum)
+        self.wheel = TimerWheel()
+        self.states = {}  # key -> [sensor, last seen, last timestamp, interval, timer tick, online]
+        self.lock = threading.Lock()
+
+    def configure(self, interval=60, factor=3, minimum=300):
+        self.interval = float(interval)
+        self.factor = float(factor)
+        self.minimum = float(minimum)
+
+    def reading(self, key, sensor, timestamp, now=None):
+        '''
+        records a reading of a sensor. timestamp is the timestamp of the reading, used to learn the interval
+        '''
+        now = time.time() if now is None else now
+        with self.lock:
+            state = self.states.get(key)
+            if state is None:
+                state = [sensor, now, timestamp, self.interval, None, True]
+                self.states[key] = state
+                cameBack = False
+            else:
+                delta = timestamp - state[2]
+                # readings of the flash backlog and duplicates from several receivers are not used
+                if 0 < delta < 86400:
+                    state[3] += self.ALPHA * (delta - state[3])
+                state[0] = sensor
+                state[1] = now
+                state[2] = max(timestamp, state[2])
+                cameBack = not state[5]
+                state[5] = True
+            if state[4] is not None:
+                self.wheel.remove(key, state[4])
+            state[4] = self.wheel.add(key, now + max(self.minimum, self.factor * state[3]))
+        if cameBack:
+            logging.info("Sensor %s is online again", sensor.id)
+            self.callback(sensor, True, now)
+
+    def tick(self, now=None):
+        '''
+        sends offline events for all sensors whose deadline passed
+        '''
+        now = time.time() if now is None else now
+        offline = []
+        with self.lock:
+            for key in self.wheel.advance(now):
+                state = self.states.get(key)
+                if state is None:
+                    continue
+                state[4] = None
+                state[5] = False
+                offline.append(state)
+        for state in offline:
+            logging.warning("Sensor %s is offline. Last reading %d seconds ago", state[0].id, now - state[1])
+            self.callback(state[0], False, state[1])
+
+    def forget(self, key):
+        with self.lock:
+            state = self.states.pop(key, None)
+            if state is not None and state[4] is not None:
+                self.wheel.remove(key, state[4])
+
+    def status(self):
+        '''
+        returns (sensor, online, last seen, interval) of all tracked sensors
+        '''
+        with self.lock:
+            return [(s[0], s[5], s[1], s[3]) for s in self.states.values()]
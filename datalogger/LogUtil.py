@@ -0,0 +1,67 @@
+'''
+Created on 19.10.2026
+
+@license: pylarexx is licensed under the Apache License, version 2, see License.txt
+
+Rate limited logging for messages that can repeat with every reading, like stale timestamps,
+values out of range or unknown sensors.
+'''
+
+import time
+import logging
+
+
+class RateLimitedLog(object):
+    '''
+    Logs a message at most once per interval and key. Suppressed messages are counted,
+    the count is appended to the next message with the same key. flush logs the last suppressed
+    message of keys that were quiet for the interval, so the count of a burst is not lost.
+    '''
+
+    def __init__(self, interval=300):
+        self.interval = interval
+        self.entries = {}  # key -> [time of last logged message, suppressed messages, last suppressed (level, msg, args)]
+
+    def log(self, level, key, msg, *args):
+        if not logging.getLogger().isEnabledFor(level):
+            return
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry is not None and now - entry[0] < self.interval:
+            entry[1] += 1
+            entry[2] = (level, msg, args)
+            return
+        if entry is not None and entry[1] > 0:
+            msg += ' (%d similar messages suppressed)'
+            args += (entry[1],)
+        # the record gets file and line of the caller of info/warning/error
+        logging.log(level, msg, *args, stacklevel=3)
+        self.entries[key] = [now, 0, None]
+
+    def flush(self):
+        '''
+        called periodically, e.g. between polling rounds
+        '''
+        now = time.monotonic()
+        for key, entry in list(self.entries.items()):
+            if now - entry[0] < self.interval:
+                continue
+            if entry[1] > 0:
+                level, msg, args = entry[2]
+                logging.log(level, msg + ' (%d similar messages suppressed)', *(args + (entry[1] - 1,)))
+                self.entries[key] = [now, 0, None]
+            else:
+                del self.entries[key]
+
+    def info(self, key, msg, *args):
+        self.log(logging.INFO, key, msg, *args)
+
+    def warning(self, key, msg, *args):
+        self.log(logging.WARNING, key, msg, *args)
+
+    def error(self, key, msg, *args):
+        self.log(logging.ERROR, key, msg, *args)
+
+
+# shared instance, interval is set from config RepeatedLogInterval
+rateLimited = RateLimitedLog()
@@ -7,15 +7,24 @@ Created on 23.11.2017
 '''
 
 import usb.core
+import os
+import inspect
 import time
+import queue
+import signal
+import threading
 import math
 import array
 import datalogger.Sensor
 import datalogger.DataListener
+from datalogger.Liveness import LivenessTracker
+from datalogger.Alerts import AlertEngine
+from datalogger.Reception import ReceptionTracker
 from datalogger.DataListener import DataListener
 import logging
 import yaml
 from datalogger.Sensor import ArexxSensorDetector
+from datalogger.LogUtil import rateLimited
 from datetime import datetime
 from pprint import pformat
 
@@ -27,29 +36,66 @@ class TLX00(object):
     This class handles USB connection and communication for Arexx TL-300 and TL-500 devices and BS-510
     '''
     TIME_OFFSET = 946681200           # Timestamp of 2000-01-01 00:00:00
+    asyncListeners = False            # listeners with async onNewData need the asyncio engine
 
     def __init__(self, params):
         self.devices=[]
         self.listeners=[]
-        self.sensors={}
+        self.sensors=datalogger.Sensor.SensorRegistry()
         self.requestBuffer = array.array('B', [0]*64)
         self.config={}
         self.detectUnknownSensors=True
         self.lastDeviceCheck=0
+        self.calibration={}
+        self.sensorSpecs={}
+        self.configSensorKeys={}
+        self.outputSpecs=[]
+        self.conffile=None
+        self.conffileMtime=None
+        self.watchConfigFile=False
+        self.reloadRequested=False
+        self.running=True
+        self.stopEvent=threading.Event()
+        self.shutdownTimeout=10
+        self.clusterReceiver=None
+        self.clusterQueue=queue.Queue(1000) # batches from cluster nodes, acknowledged but not passed on yet
+        self.liveness=LivenessTracker(self.notifySensorStatus)
+        self.alerts=AlertEngine()
+        self.reception=ReceptionTracker()
+        self.receptionStatsInterval=15
+        self.lastReceptionStats=0
+        # outputs=False reads sensors and calibration only, e.g. for batch commands
+        self.createOutputs=params.get('outputs',True)
         if 'conffile' in params:
             self.readConfigFile(params['conffile'])
 
 ## This method extract the information stored in the config file /etc/pylarexx.yml with the differnt config sections ##
 
     def readConfigFile(self,filename):
+        self.conffile=filename
+        mtime=os.path.getmtime(filename)
         with open(filename) as f:
             content=f.read()
-            self.config=yaml.load(content, Loader=yaml.SafeLoader)
-            logging.debug(self.config)
+            config=yaml.load(content, Loader=yaml.SafeLoader)
+            logging.debug(config)
+        self.applyConfig(config)
+        # a broken config is read again by ReloadOnChange
+        self.conffileMtime=mtime
 
-        if 'sensors' in self.config:
+    def applyConfig(self,config):
+        '''
+        builds sensors, calibration and outputs from a parsed config. When called again with a changed config,
+        only changed sensors and outputs are rebuilt, unchanged outputs keep running. The new sensors and
+        listeners are swapped in at the end.
+        '''
+        sensors=datalogger.Sensor.SensorRegistry()
+        sensorSpecs={}
+        configSensorKeys={}
+        changedIds=set()
+
+        if 'sensors' in config:
             try:
-                for sensor in self.config['sensors']:
+                for sensor in config['sensors']:
                     sensorid=int(sensor['id'])
                     sensortype=None
                     if 'type' in sensor:
@@ -57,57 +103,321 @@ class TLX00(object):
                     name = None
                     if 'name' in sensor:
                         name=sensor['name']
+                    sensorSpecs[sensorid]=(sensortype,name)
+                    if self.sensorSpecs.get(sensorid)==(sensortype,name):
+                        # unchanged, keep the running sensor objects
+                        configSensorKeys[sensorid]=self.configSensorKeys[sensorid]
+                        for key in configSensorKeys[sensorid]:
+                            sensors[key]=self.sensors[key]
+                        continue
+                    changedIds.add(str(sensorid))
                     logging.info("Adding Sensor from config file: %d %s %s"%(sensorid,sensortype,name))
-                    # Todo: Sensortype weg machen
-                    if sensortype in ('TL-3TSN','TSN-50E','TSN-EXT44','TSN-33MN'):
-                        self.sensors[sensorid]=datalogger.Sensor.ArexxTemperatureSensor(sensorid,sensortype,name)
-                    elif sensortype in ('TSN-TH70E', 'TSN-TH77ext'):
-                        self.sensors[sensorid]=datalogger.Sensor.ArexxTemperatureSensor(sensorid,sensortype,name)
-                        self.sensors[sensorid+1]=datalogger.Sensor.ArexxHumiditySensor(sensorid+1,sensortype,name)
-                    elif sensortype in ('TSN-CO2'):
-                        self.sensors[sensorid]=datalogger.Sensor.ArexxTemperatureSensor(sensorid,sensortype,name)
-                        self.sensors[sensorid+1]=datalogger.Sensor.ArexxCO2Sensor(sensorid+1,sensortype,name)
-                    else:
-                        # Bug? TSN-TH70E #20444 is not added by this code
-                        detected_sensor = self.detectSensor(sensorid, name)
-                        if detected_sensor != False:
-                            self.addSensor(detected_sensor)
-                        else:
-                            self.sensors[sensorid]= datalogger.Sensor.Sensor(sensorid)
-                            self.sensors[sensorid].setName(name)
+                    configSensorKeys[sensorid]=self.createConfigSensors(sensors,sensorid,sensortype,name)
             except Exception as e:
                 logging.error('Error in config section sensors: %s',e)
                 logging.debug('Stacktrace: ',exc_info=True)
 
-        if 'calibration' in self.config:
-            for c in self.config['calibration']:
+        # keep detected sensors, unless they belong to a changed or removed config sensor
+        changedIds.update(str(sid) for sid in self.sensorSpecs if sid not in sensorSpecs)
+        configKeys=set(sensors.normalizeId(key) for keys in self.configSensorKeys.values() for key in keys)
+        for key,sensor in self.sensors.items():
+            if key not in configKeys and key not in sensors and str(sensor.displayid) not in changedIds:
+                sensors[key]=sensor
+
+        calibration={}
+        if 'calibration' in config:
+            for c in config['calibration']:
                 try:
                     sensorid=int(c['id'])
-                    if not sensorid in self.sensors:
-                        logging.error('Calibration values found for sensor %i, but sensor not defined in config',sensorid)
+                    calibration[sensorid]={n: float(v) for n,v in c['values'].items()}
+                    if not sensorid in sensors:
+                        logging.info('Calibration values found for sensor %i, but sensor not defined in config. Values are used when the sensor is detected',sensorid)
                         continue;
                     for n,v in c['values'].items():
-                        self.sensors[sensorid].calibrationValues[n] = float(v)
                         logging.debug("Calibration value for sensor %d oder %d value %f"%(sensorid,n,float(v)))
                 except Exception as e:
                     logging.error('Error in config section calibration: %s',e)
                     logging.debug('Stacktrace: ',exc_info=True)
+        for sensor in sensors.values():
+            if str(sensor.id).isdigit():
+                # a new dict is assigned, running sensors switch to the new values at once
+                sensor.calibrationValues=dict(calibration.get(int(sensor.id),{}))
+
+        self.alerts.configure(config.get('alerts'))
+
+        listeners=[l for l in self.listeners if l not in [spec[1] for spec in self.outputSpecs]]
+        outputSpecs=[]
+        oldSpecs=list(self.outputSpecs)
+        newOutputs=[]
+        if 'output' in config and self.createOutputs:
+            outputs=config['output']
+            workers=int((config.get('config') or {}).get('Workers',0))
+            if workers>0:
+                # outputs run in worker processes, one WorkerListener output per worker
+                from datalogger.Workers import shardOutputs
+                outputs=shardOutputs(outputs,workers,float(config['config'].get('RepeatedLogInterval',300)))
+            for logger in outputs:
+                key=yaml.dump(logger,sort_keys=True)
+                running=[spec for spec in oldSpecs if spec[0]==key]
+                if len(running)>0:
+                    oldSpecs.remove(running[0])
+                    outputSpecs.append(running[0])
+                else:
+                    newOutputs.append((key,logger))
+        # stop removed outputs first, new ones may want to use the same resources. They get no readings while they close
+        removed=[spec[1] for spec in oldSpecs]
+        self.listeners=[l for l in self.listeners if l not in removed]
+        for key,listener in oldSpecs:
+            logging.info("Removing DataListener %s",type(listener).__name__)
+            self.closeListener(listener)
+        for key,logger in newOutputs:
+            try:
+                loggerType = logger.get('type')
+                params= logger.get('params',{})
+                listenerClass = datalogger.DataListener.findListenerClass(loggerType)
+                listener=listenerClass(params)
+                if not self.asyncListeners and inspect.iscoroutinefunction(listener.onNewData):
+                    logging.error('Output %s needs the asyncio engine (--engine asyncio)',loggerType)
+                elif isinstance(listener,DataListener):
+                    logging.debug("Registering DataListener %s",type(listener).__name__)
+                    listener.start()
+                    outputSpecs.append((key,listener))
+            except Exception as e:
+                logging.error('Error in config section output: %s',e)
+                logging.debug('Stacktrace: ',exc_info=True)
+        listeners+=[spec[1] for spec in outputSpecs]
+
+        detectUnknownSensors=True
+        watchConfigFile=False
+        if 'config' in config:
+            if 'DetectUnknownSensors' in config['config']:
+                detectUnknownSensors=bool(config['config']['DetectUnknownSensors'])
+            watchConfigFile=bool(config['config'].get('ReloadOnChange',False))
+            self.shutdownTimeout=float(config['config'].get('ShutdownTimeout',10))
+            rateLimited.interval=float(config['config'].get('RepeatedLogInterval',300))
+            self.liveness.configure(float(config['config'].get('ExpectedInterval',60)),
+                                    float(config['config'].get('OfflineFactor',3)),
+                                    float(config['config'].get('OfflineMinimum',300)))
+            self.reception.routing=bool(config['config'].get('ReceiverRouting',False))
+            self.receptionStatsInterval=float(config['config'].get('ReceptionStatsInterval',15))
+        if self.createOutputs:
+            self.configureClusterReceiver(config.get('config') or {})
+
+        for key in self.sensors:
+            if key not in sensors:
+                self.liveness.forget(key)
+                self.reception.forget(key)
+        self.config=config
+        self.sensorSpecs=sensorSpecs
+        self.configSensorKeys=configSensorKeys
+        self.calibration=calibration
+        self.outputSpecs=outputSpecs
+        self.sensors=sensors
+        self.listeners=listeners
+        self.detectUnknownSensors=detectUnknownSensors
+        self.watchConfigFile=watchConfigFile
+
+    def closeListener(self,listener):
+        '''
+        closes an output that was removed from the config
+        '''
+        listener.close()
 
+    def createConfigSensors(self,sensors,sensorid,sensortype,name):
+        '''
+        creates the sensor(s) of a config entry in sensors and returns their keys
+        '''
+        # Todo: Sensortype weg machen
+        if sensortype in ('TL-3TSN','TSN-50E','TSN-EXT44','TSN-33MN'):
+            sensors[sensorid]=datalogger.Sensor.ArexxTemperatureSensor(sensorid,sensortype,name)
+            return [sensorid]
+        elif sensortype in ('TSN-TH70E', 'TSN-TH77ext'):
+            sensors[sensorid]=datalogger.Sensor.ArexxTemperatureSensor(sensorid,sensortype,name)
+            humidity=datalogger.Sensor.ArexxHumiditySensor(sensorid+1,sensortype,name)
+            humidity.displayid=sensorid # multi sensors share the display id
+            sensors[sensorid+1]=humidity
+            return [sensorid,sensorid+1]
+        elif sensortype in ('TSN-CO2',):
+            sensors[sensorid]=datalogger.Sensor.ArexxTemperatureSensor(sensorid,sensortype,name)
+            co2=datalogger.Sensor.ArexxCO2Sensor(sensorid+1,sensortype,name)
+            co2.displayid=sensorid
+            sensors[sensorid+1]=co2
+            return [sensorid,sensorid+1]
+        # Bug? TSN-TH70E #20444 is not added by this code
+        detected_sensor = self.detectSensor(sensorid, name)
+        if detected_sensor != False:
+            logging.info("Adding Sensor %s", detected_sensor.name)
+            sensors[detected_sensor.id]=detected_sensor
+            return [detected_sensor.id]
+        sensors[sensorid]= datalogger.Sensor.Sensor(sensorid)
+        sensors[sensorid].setName(name)
+        return [sensorid]
+
+    def configureClusterReceiver(self,config):
+        '''
+        starts, restarts or stops the receiver for edge nodes (config ClusterListen: host:port, ClusterToken)
+        '''
+        listen=config.get('ClusterListen')
+        token=config.get('ClusterToken')
+        receiver=self.clusterReceiver
+        if receiver is not None and listen == '%s:%d' % (receiver.host,receiver.port) and token == receiver.token:
+            return
+        self.stopClusterReceiver()
+        if listen:
+            from datalogger.Cluster import ClusterReceiver
+            host,port=str(listen).rsplit(':',1)
+            try:
+                self.clusterReceiver=ClusterReceiver(self.clusterQueue,host,int(port),token)
+                self.clusterReceiver.start()
+            except Exception as e:
+                logging.error('Unable to listen for cluster nodes at %s: %s',listen,e)
+                self.clusterReceiver=None
 
-        if 'output' in self.config:
-            for logger in self.config['output']:
-                try:
-                    loggerType = logger.get('type')
-                    params= logger.get('params',{})
-                    listenerClass = getattr(datalogger.DataListener,loggerType)
-                    self.registerDataListener(listenerClass(params))
-                except Exception as e:
-                    logging.error('Error in config section output: %s',e)
-                    logging.debug('Stacktrace: ',exc_info=True)
+    def stopClusterReceiver(self):
+        if self.clusterReceiver is not None:
+            self.clusterReceiver.close()
+            self.clusterReceiver=None
+
+    def notifyListeners(self,datapoint,sensor):
+        for l in self.listeners:
+            try:
+                l.onNewData(datapoint, sensor)
+            except Exception as e:
+                rateLimited.error(('listener',type(l).__name__),"Error in DataListener %s: %s",type(l).__name__,e)
+
+    def notifySensorStatus(self,sensor,online,lastSeen):
+        '''
+        called by the liveness tracker when a sensor goes offline or comes back
+        '''
+        for l in self.listeners:
+            try:
+                l.onSensorStatus(sensor, online, lastSeen)
+            except Exception as e:
+                rateLimited.error(('status',type(l).__name__),"Error in DataListener %s: %s",type(l).__name__,e)
+
+    def checkAlerts(self,key,sensor,datapoint):
+        for alert in self.alerts.evaluate(key,sensor,datapoint):
+            self.notifyAlert(alert)
+
+    def notifyAlert(self,alert):
+        for l in self.listeners:
+            try:
+                l.onAlert(alert)
+            except Exception as e:
+                rateLimited.error(('alert',type(l).__name__),"Error in DataListener %s: %s",type(l).__name__,e)
+
+    def clusterReadings(self):
+        '''
+        yields the queued readings of cluster nodes as (datapoint, sensor) that are passed on to the listeners
+        '''
+        while True:
+            try:
+                batch=self.clusterQueue.get_nowait()
+            except queue.Empty:
+                return
+            for node,datapoint,sensor in batch:
+                self.liveness.reading((node,sensor.id),sensor,datapoint['timestamp'])
+                # the node is the receiver, so a sensor heard by several nodes is routed like one heard by several receivers
+                if not self.reception.reading(sensor.id,sensor,node,datapoint['timestamp'],datapoint['signal'],
+                                              ((node,sensor.id),datapoint,sensor)):
+                    continue
+                self.checkAlerts((node,sensor.id),sensor,datapoint)
+                yield datapoint,sensor
+
+    def releaseHeldReadings(self):
+        '''
+        passes on readings of other receivers that the best receiver of their sensor missed (ReceiverRouting)
+        '''
+        for key,datapoint,sensor in self.reception.release():
+            self.checkAlerts(key,sensor,datapoint)
+            self.notifyListeners(datapoint,sensor)
+
+    def publishReceptionStats(self):
+        '''
+        passes the reception statistics to the listeners every ReceptionStatsInterval seconds
+        '''
+        if time.time() - self.lastReceptionStats < self.receptionStatsInterval:
+            return
+        self.lastReceptionStats=time.time()
+        self.notifyReceptionStats(self.reception.snapshot())
+
+    def notifyReceptionStats(self,rows):
+        for l in self.listeners:
+            try:
+                l.onReceptionStats(rows)
+            except Exception as e:
+                rateLimited.error(('reception',type(l).__name__),"Error in DataListener %s: %s",type(l).__name__,e)
 
-        if 'config' in self.config:
-            if 'DetectUnknownSensors' in self.config['config']:
-                self.detectUnknownSensors=bool(self.config['config']['DetectUnknownSensors'])
+    def installSignalHandlers(self):
+        '''
+        must be called from the main thread
+        '''
+        signal.signal(signal.SIGHUP, self.requestReload)
+        signal.signal(signal.SIGTERM, self.requestShutdown)
+        signal.signal(signal.SIGINT, self.requestShutdown)
+
+    def requestShutdown(self,signum=None,frame=None):
+        '''
+        signal handler for SIGTERM and SIGINT. The polling loop stops after the current read
+        '''
+        logging.warning("Shutdown requested")
+        self.running=False
+        self.stopEvent.set()
+
+    def shutdown(self):
+        '''
+        flushes and closes all listeners and releases the USB devices. Listeners get
+        the shutdown timeout (config ShutdownTimeout) together to flush their data.
+        '''
+        deadline=time.time()+self.shutdownTimeout
+        self.stopClusterReceiver()
+        # acknowledged readings of cluster nodes are not sent again
+        for datapoint,sensor in self.clusterReadings():
+            self.notifyListeners(datapoint,sensor)
+        for l in self.listeners:
+            try:
+                if not l.flush(max(0.0,deadline-time.time())):
+                    logging.error("DataListener %s did not flush all data in time",type(l).__name__)
+            except Exception as e:
+                logging.error("Error flushing DataListener %s: %s",type(l).__name__,e)
+        for l in self.listeners:
+            try:
+                l.close()
+            except Exception as e:
+                logging.error("Error closing DataListener %s: %s",type(l).__name__,e)
+        for d in self.devices:
+            try:
+                usb.util.dispose_resources(d)
+            except Exception as e:
+                logging.error("Error releasing device: %s",e)
+        logging.info("Shutdown complete")
+
+    def requestReload(self,signum=None,frame=None):
+        '''
+        signal handler for SIGHUP. The config file is reloaded by the polling loop between two polls
+        '''
+        self.reloadRequested=True
+
+    def checkConfigReload(self):
+        if self.conffile is None:
+            return
+        if self.watchConfigFile and not self.reloadRequested:
+            try:
+                if os.path.getmtime(self.conffile) != self.conffileMtime:
+                    rateLimited.info(('changed',self.conffile),"Config file %s changed", self.conffile)
+                    self.reloadRequested=True
+            except OSError as e:
+                logging.error("Unable to check config file %s: %s", self.conffile, e)
+        if self.reloadRequested:
+            self.reloadRequested=False
+            # a broken config file is retried between every polling round until it is fixed
+            rateLimited.warning(('reloading',self.conffile),"Reloading config file %s", self.conffile)
+            try:
+                self.readConfigFile(self.conffile)
+            except Exception as e:
+                # keep the running config
+                rateLimited.error(('reload',self.conffile),"Error reloading config file: %s", e)
+                logging.debug('Stacktrace: ',exc_info=True)
 
     # detect sensor and return it. Returns False, if no sensor was detected.
     # If detectUnknownSensors is set to false, return a sensor only if it is in config via displayid
@@ -117,15 +427,17 @@ class TLX00(object):
         detected_sensor = detector.detectDevice(sensorid)
         is_in_config=False
         if detected_sensor != False:
-            logging.debug("Detected Sensor: %s(%s)" % (detected_sensor.id, detected_sensor.type) )
-            if name != None:
+            logging.debug("Detected Sensor: %s(%s)", detected_sensor.id, detected_sensor.type)
+            if name != None: # sensor from config
                 detected_sensor.setName(name)
-            else:# check if we have a sensor in config with the same display id. Then copy name
-                for sensor in self.sensors.items():
-                    if sensor[0] == detected_sensor.displayid:
-                        detected_sensor.setName(sensor[1].name)
-                        logging.info("Setting name of detected sensor to: %s" % detected_sensor.name)
-                        is_in_config=True
+                is_in_config=True
+            elif detected_sensor.displayid in self.configSensorKeys:
+                # a sensor in config with the same display id. Copy the name
+                configSensor=self.sensors.get(detected_sensor.displayid)
+                if configSensor is not None:
+                    detected_sensor.setName(configSensor.name)
+                    logging.info("Setting name of detected sensor to: %s", detected_sensor.name)
+                is_in_config=True
         if self.detectUnknownSensors or is_in_config:
             return detected_sensor
         return False
@@ -133,16 +445,18 @@ class TLX00(object):
     # checks if data match to sensor value range and time
     def validateSensorData(self,data,sensor):
         if abs(time.time() - data["timestamp"]) > 4000: # On DST changes we can get 3600sec difference.
-            logging.info("validateSensorData: timestamp %s is stale. Is a buffering receiver used?", datetime.fromtimestamp(data["timestamp"]).strftime('%Y-%m-%d %H:%M:%S'))
+            rateLimited.info(('stale',sensor.id), "validateSensorData: timestamp %s of sensor %s is stale. Is a buffering receiver used?", datetime.fromtimestamp(data["timestamp"]), sensor.id)
         cooked=sensor.rawToCooked(data["rawvalue"])
         if cooked > sensor.valmax or cooked < sensor.valmin:
-            logging.info("validateSensorData: Datapoint %f outside range (%f/%f). Ignoring." % (cooked, sensor.valmin, sensor.valmax))
+            rateLimited.info(('range',sensor.id), "validateSensorData: Datapoint %f of sensor %s outside range (%f/%f). Ignoring.", cooked, sensor.id, sensor.valmin, sensor.valmax)
             return False
         return True
 
     def addSensor(self,detected_sensor):
         logging.info("Adding Sensor %s", detected_sensor.name)
-        self.sensors[detected_sensor.id] = detected_sensor
+        if len(detected_sensor.calibrationValues) == 0 and str(detected_sensor.id).isdigit() and int(detected_sensor.id) in self.calibration:
+            detected_sensor.calibrate(dict(self.calibration[int(detected_sensor.id)]))
+        self.sensors.add(detected_sensor)
 
     def removeSensor(self,sensorid):
         logging.info("Removing Sensor %s", self.sensors[sensorid].name)
@@ -166,6 +480,8 @@ class TLX00(object):
                 d.deviceErrors = 0
                 d.lastTimeSync = 0
                 d.lastTimeDelete = 0
+                # like the sysfs name of the device, e.g. 1-1.2, does not change when the device is plugged in again
+                d.receiver = '%d-%s' % (d.bus, '.'.join(str(p) for p in (d.port_numbers or (d.port_number,))))
                 logging.info("Bus %d Address %d Port Number %d " % (d.bus,d.address,d.port_number))
             return True
         logging.error("No device found")
@@ -203,7 +519,7 @@ class TLX00(object):
 # Method to set the time on the logging device
 
     def setTime(self,device):
-        logging.debug("Setting time for USB device at Bus %d Address %d Port Number %d" % (device.bus,device.address,device.port_number))
+        logging.debug("Setting time for USB device at Bus %d Address %d Port Number %d", device.bus,device.address,device.port_number)
         # set mode
         self.clearRequestBuffer()
         self.requestBuffer[0]=4 # Protocol.txt says with type 04 the time can be set on the device
@@ -226,7 +542,7 @@ class TLX00(object):
 # Mehtod will delete the internal flash data of the Logger. this done by preparing the buffer and send it to the logger
 
     def deleteDeviceData(self,device):
-        logging.debug("deleting internal Flash data of USB device at Bus %d Address %d Port Number %d" % (device.bus,device.address,device.port_number))
+        logging.debug("deleting internal Flash data of USB device at Bus %d Address %d Port Number %d", device.bus,device.address,device.port_number)
         # set mode
         self.clearRequestBuffer()
         self.requestBuffer[0]=0x0d # this mode will delete the flash memory of the device 
@@ -241,6 +557,7 @@ class TLX00(object):
     def registerDataListener(self, dataListener):
         if isinstance(dataListener,DataListener):
             logging.debug("Registering DataListener %s",type(dataListener).__name__)
+            dataListener.start()
             self.listeners.append(dataListener)
 
     def unregisterDataListener(self, dataListener):
@@ -291,9 +608,6 @@ class TLX00(object):
                 signal=None
                 if data[pos] == 12:
                     signal = int.from_bytes([data[pos+11]],byteorder = 'little', signed=False)
-                if self.detectUnknownSensors and sensorid not in self.sensors:
-                    self.addSensor(sensorid)
-
                 datapoints.append({'sensorid': sensorid, 'rawvalue': rawvalue, 'timestamp': timestamp+self.TIME_OFFSET, 'signal':signal})
                 # logging.info("Found Datapoint from sensor %d with value %d" % (sensorid,rawvalue))
                 pos+=data[pos]-1
@@ -303,6 +617,85 @@ class TLX00(object):
         return datapoints
 
 
+    def maintainDevice(self,dev):
+        # do time sync every 900 sec
+        if int(time.time()) - dev.lastTimeSync > 900:
+            self.setTime(dev)
+
+        # delete internal flash every day # todo: make interval configurable or count entries
+        if int(time.time()) - dev.lastTimeDelete > 86400:
+            self.deleteDeviceData(dev)
+
+    def readPacket(self,dev):
+        '''
+        requests one packet from the device and returns its datapoints, or None if the device has no new data
+        '''
+        logging.debug("write and read data from device")
+        self.clearRequestBuffer()
+        self.requestBuffer[0]=3
+
+        dev.write(dev.outAddress, self.requestBuffer,1000) # send request to read the sensors
+        time.sleep(0.01)
+        rawdata=dev.read(dev.inAddress,64,1000) # request the result from logger
+        if rawdata[0]==0 and rawdata[1]==0:
+            # no new data
+            return None
+        dev.lastTimeDataRead = int(time.time()) # store new time of new retrieved data
+        datapoints = self.parseData(rawdata) # method to get process buffer data into usable data
+        for datapoint in datapoints:
+            datapoint['receiver'] = dev.receiver
+        return datapoints
+
+    def sensorForDatapoint(self,datapoint):
+        '''
+        returns the sensor of a datapoint, detecting new sensors, or None if the sensor is unknown or the data are invalid
+        '''
+        sensorid=self.sensors.normalizeId(datapoint["sensorid"])
+        sensor=self.sensors.lookup(sensorid)
+        if sensor is None:
+            if self.sensors.isUnknown(sensorid):
+                return None
+            detected_sensor=self.detectSensor(sensorid)
+            if detected_sensor == False:
+                logging.info("Ignoring data of unknown sensor %s", sensorid)
+                self.sensors.markUnknown(sensorid)
+                return None
+            if not self.validateSensorData(datapoint, detected_sensor):
+                return None
+            self.addSensor(detected_sensor)
+            sensor=detected_sensor
+        elif not sensor.hasConversion():
+            rateLimited.info(('noconversion',sensorid), "Ignoring data of sensor %s, its type is unknown", sensorid)
+            return None
+        elif not self.validateSensorData(datapoint, sensor):
+            return None
+        self.liveness.reading(sensorid, sensor, datapoint["timestamp"])
+        if not self.reception.reading(sensorid, sensor, datapoint.get('receiver', 'local'), datapoint["timestamp"],
+                                      datapoint["signal"], (sensorid, datapoint, sensor)):
+            return None
+        self.checkAlerts(sensorid, sensor, datapoint)
+        return sensor
+
+    def maintenance(self):
+        '''
+        work between two polling rounds: supervise workers, reload config, look for new devices
+        '''
+        for l in self.listeners:
+            if hasattr(l,'supervise'):
+                l.supervise()
+        for datapoint,sensor in self.clusterReadings():
+            self.notifyListeners(datapoint,sensor)
+        self.liveness.tick()
+        self.releaseHeldReadings()
+        self.publishReceptionStats()
+        rateLimited.flush()
+        self.checkConfigReload()
+        if math.floor(time.time()) > self.lastDeviceCheck + 60:
+            logging.debug("Checking for new Devices")
+            if self.checkForNewDevices() :
+                self.findDevices()
+                self.initializeDevices()
+
 # Method to extract the data. It starts by first if any listeners are currently up.
 # Then checks when was the last time the time has been set on the Logger.
 # It also resets the internal flash every day.
@@ -313,50 +706,29 @@ class TLX00(object):
     def loop(self):
         '''
         constantly reads data from TL-X00 devices as long as DataListeners are registered.
-        Stops reading when the last Listener deregisters.
+        Stops reading when the last Listener deregisters or a shutdown is requested.
         '''
         self.clearRequestBuffer()
 
-        while len(self.listeners) > 0:
-            for dev in self.devices:
-                logging.debug("Polling device at Bus %d Address %d Port Number %d" % (dev.bus,dev.address,dev.port_number))
-                # do time sync every 900 sec
-                if int(time.time()) - dev.lastTimeSync > 900:
-                    self.setTime(dev)
-
-                # delete internal flash every day # todo: make interval configurable or count entries
-                if int(time.time()) - dev.lastTimeDelete > 86400:
-                    self.deleteDeviceData(dev)
+        while len(self.listeners) > 0 and self.running:
+            for dev in list(self.devices):
+                if not self.running:
+                    break
+                logging.debug("Polling device at Bus %d Address %d Port Number %d", dev.bus,dev.address,dev.port_number)
+                self.maintainDevice(dev)
 
                 readcount=0
                 founddata=0
-                while True:
+                while self.running:
                     try:
-                        logging.debug("write and read data from device")
-                        self.clearRequestBuffer()
-                        self.requestBuffer[0]=3
-
-                        dev.write(dev.outAddress, self.requestBuffer,1000) # send request to read the sensors
-                        time.sleep(0.01)
-                        rawdata=dev.read(dev.inAddress,64,1000) # request the result from logger
-                        if rawdata[0]==0 and rawdata[1]==0:
-                            # no new data
+                        datapoints = self.readPacket(dev)
+                        if datapoints is None:
                             break
-                        dev.lastTimeDataRead = int(time.time()) # store new time of new retrieved data
-                        datapoints = self.parseData(rawdata) # method to get process buffer data into usable data
                         # notify listeners
                         for datapoint in datapoints:
-                            sensorid=str(datapoint["sensorid"])
-                            if sensorid not in self.sensors:
-                                detected_sensor=self.detectSensor(sensorid)
-                                if detected_sensor != False:
-                                    if self.validateSensorData(datapoint, detected_sensor):
-                                        self.addSensor(detected_sensor)
-                            if sensorid in self.sensors:
-                                sensor=self.sensors[sensorid]
-                                if self.validateSensorData(datapoint, sensor):
-                                    for l in self.listeners:
-                                        l.onNewData(datapoint, sensor) # invoke method to share new data to the listerners
+                            sensor=self.sensorForDatapoint(datapoint)
+                            if sensor is not None:
+                                self.notifyListeners(datapoint, sensor) # share new data with the listeners
                         founddata += len(datapoints)
                         readcount += 1
                         if founddata == 0 and readcount > 5:
@@ -366,19 +738,15 @@ class TLX00(object):
                         # sleep again before polling device
                         time.sleep(0.01)
                     except Exception as e:
-                        raise
-                        logging.info("Unable to read new data: %s" % e)
+                        rateLimited.info(('read',id(dev)),"Unable to read new data: %s",e)
                         # logging.debug(traceback.format_exc())
                         dev.deviceErrors += 1
                         if dev.deviceErrors > 10 :
-                            logging.warn("Too many errors. Removing device on Bus %d Address %d Port Number %d" % (dev.bus,dev.address,dev.port_number))
-                            self.devices.remove(dev) # untested!
+                            logging.warning("Too many errors. Removing device on Bus %d Address %d Port Number %d" % (dev.bus,dev.address,dev.port_number))
+                            self.devices.remove(dev)
                         break
             # do not busy poll. Sleep one second
             logging.debug("sleeping")
-            time.sleep(4)
-            if math.floor(time.time()) > self.lastDeviceCheck + 60:
-                logging.debug("Checking for new Devices")
-                if self.checkForNewDevices() :
-                    self.findDevices()
-                    self.initializeDevices()
+            if self.stopEvent.wait(4):
+                break
+            self.maintenance()
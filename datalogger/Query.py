@@ -0,0 +1,221 @@
+'''
+Created on 19.10.2026
+
+@license: pylarexx is licensed under the Apache License, version 2, see License.txt
+
+Read access to stored readings. A store answers "sensor X between t1 and t2, downsampled to N points"
+and yields the result row by row, so that large ranges never have to be loaded into memory.
+The Sqlite3Store reads the database written by Sqlite3Listener and uses its index and rollup tables,
+the FileStore reads the file of a FileOutListener (readings only, used by the export).
+'''
+
+import math
+import json
+import sqlite3
+import logging
+
+# bucket widths (seconds) of the rollup table maintained by Sqlite3Listener
+ROLLUP_WIDTHS = (300, 3600, 86400)
+
+ROLLUP_TABLE = '''CREATE TABLE IF NOT EXISTS pylarexx_rollup (sensorid integer, SensorType string, Unit string, width integer, bucket long, count integer, total float, minimum float, maximum float, PRIMARY KEY (sensorid, SensorType, width, bucket));'''
+
+CSV_FIELDS = ('timestamp', 'sensorid', 'type', 'unit', 'value', 'min', 'max', 'count')
+
+# fields of single readings as returned by readings()
+READING_FIELDS = ('timestamp', 'sensorid', 'name', 'type', 'unit', 'value', 'rawvalue', 'rawsensorid', 'signal')
+
+
+class Sqlite3Store(object):
+    '''
+    Queries the pylarexx table and the pylarexx_rollup table of a Sqlite3Listener database.
+    A store is bound to the thread that created it, since sqlite3 connections are.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.conn = sqlite3.connect('file:%s?mode=ro' % filename, uri=True)
+
+    def close(self):
+        self.conn.close()
+
+    def sensors(self):
+        '''
+        yields all sensors that have stored readings with first and last timestamp
+        '''
+        curs = self.conn.execute('''SELECT sensorid, SensorType, Unit, min(timestamp), max(timestamp), count(*)
+            FROM pylarexx GROUP BY sensorid, SensorType, Unit ORDER BY sensorid;''')
+        for row in curs:
+            yield {'sensorid': row[0], 'type': row[1], 'unit': row[2], 'first': row[3], 'last': row[4], 'count': row[5]}
+
+    def query(self, sensorid, start, end, points=None, sensortype=None):
+        '''
+        yields readings of sensorid with start <= timestamp < end. If points is given, the range is divided into
+        at most points buckets and min/max/mean of each bucket is returned. Buckets are read from the rollup
+        table if a rollup width fits into the bucket size, otherwise they are aggregated from raw rows.
+        '''
+        start = int(start)
+        end = int(end)
+        if points is None or int(points) <= 0:
+            return self.queryRaw(sensorid, start, end, sensortype)
+        step = max(1, int(math.ceil((end - start) / int(points))))
+        widths = [w for w in ROLLUP_WIDTHS if w <= step]
+        if len(widths) > 0 and self.hasRollups():
+            return self.queryRollup(sensorid, start, end, step, widths[-1], sensortype)
+        return self.queryBuckets(sensorid, start, end, step, sensortype)
+
+    def readings(self, sensorids=None, start=0, end=2**32):
+        '''
+        yields all stored readings with start <= timestamp < end, of the given display ids or of all sensors.
+        With sensor ids or a time range the index on (sensorid, timestamp) is used per stored sensor id and
+        readings come ordered by sensor and time. A full export reads the table in insertion order.
+        '''
+        columns = [row[1] for row in self.conn.execute('''PRAGMA table_info(pylarexx);''')]
+        raw = ', '.join(c if c in columns else 'NULL' for c in ('rawvalue', 'rawsensorid'))
+        sql = '''SELECT timestamp, sensorid, Location, SensorType, Unit, SensorValue, %s FROM pylarexx
+            WHERE timestamp >= ? AND timestamp < ?''' % raw
+        if sensorids:
+            queries = [(sql + ' AND sensorid = ? ORDER BY timestamp;', (int(start), int(end), int(sid)))
+                       for sid in sorted(set(sensorids))]
+        elif start > 0 or end < 2**32:
+            # there is no index on timestamp alone
+            stored = [row[0] for row in self.conn.execute('''SELECT DISTINCT sensorid FROM pylarexx ORDER BY sensorid;''')]
+            queries = [(sql + ' AND sensorid = ? ORDER BY timestamp;', (int(start), int(end), sid)) for sid in stored]
+        else:
+            queries = [(sql + ' ORDER BY id;', (int(start), int(end)))]
+        for query, args in queries:
+            for row in self.conn.execute(query, args):
+                # the column type "string" has numeric affinity, numeric names and ids come back as int
+                name, sensortype, unit, rawsensorid = (None if v is None else str(v) for v in (row[2], row[3], row[4], row[7]))
+                yield {'timestamp': row[0], 'sensorid': row[1], 'name': name, 'type': sensortype, 'unit': unit,
+                       'value': row[5], 'rawvalue': row[6], 'rawsensorid': rawsensorid, 'signal': None}
+
+    def hasRollups(self):
+        curs = self.conn.execute("SELECT count(*) FROM sqlite_master WHERE type='table' AND name='pylarexx_rollup';")
+        return curs.fetchone()[0] > 0
+
+    def typeFilter(self, sensortype, column):
+        if sensortype is None:
+            return '', ()
+        return ' AND %s = ?' % column, (sensortype,)
+
+    def queryRaw(self, sensorid, start, end, sensortype):
+        typesql, typeargs = self.typeFilter(sensortype, 'SensorType')
+        curs = self.conn.execute('''SELECT timestamp, sensorid, SensorType, Unit, SensorValue FROM pylarexx
+            WHERE sensorid = ? AND timestamp >= ? AND timestamp < ?%s ORDER BY timestamp;''' % typesql,
+                                 (sensorid, start, end) + typeargs)
+        for row in curs:
+            yield {'timestamp': row[0], 'sensorid': row[1], 'type': row[2], 'unit': row[3], 'value': row[4],
+                   'min': row[4], 'max': row[4], 'count': 1}
+
+    def queryBuckets(self, sensorid, start, end, step, sensortype):
+        typesql, typeargs = self.typeFilter(sensortype, 'SensorType')
+        curs = self.conn.execute('''SELECT (CAST(timestamp AS INTEGER) - ?) / ? AS b, sensorid, SensorType, Unit,
+            avg(SensorValue), min(SensorValue), max(SensorValue), count(*) FROM pylarexx
+            WHERE sensorid = ? AND timestamp >= ? AND timestamp < ?%s
+            GROUP BY b, SensorType, Unit ORDER BY b;''' % typesql,
+                                 (start, step, sensorid, start, end) + typeargs)
+        for row in curs:
+            yield {'timestamp': start + row[0] * step, 'sensorid': row[1], 'type': row[2], 'unit': row[3],
+                   'value': row[4], 'min': row[5], 'max': row[6], 'count': row[7]}
+
+    def queryRollup(self, sensorid, start, end, step, width, sensortype):
+        '''
+        rollup buckets are aligned to width, so the first and last bucket may contain some readings
+        just outside of the requested range
+        '''
+        typesql, typeargs = self.typeFilter(sensortype, 'SensorType')
+        alignedStart = start - start % width
+        curs = self.conn.execute('''SELECT (bucket - ?) / ? AS b, sensorid, SensorType, Unit,
+            sum(total) / sum(count), min(minimum), max(maximum), sum(count) FROM pylarexx_rollup
+            WHERE sensorid = ? AND width = ? AND bucket >= ? AND bucket < ?%s
+            GROUP BY b, SensorType, Unit ORDER BY b;''' % typesql,
+                                 (start, step, sensorid, width, alignedStart, end) + typeargs)
+        for row in curs:
+            yield {'timestamp': start + max(row[0], 0) * step, 'sensorid': row[1], 'type': row[2], 'unit': row[3],
+                   'value': row[4], 'min': row[5], 'max': row[6], 'count': row[7]}
+
+
+class FileStore(object):
+    '''
+    Reads the file of a FileOutListener line by line. Files have no index, readings() scans the whole file.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'r')
+
+    def close(self):
+        self.file.close()
+
+    def readings(self, sensorids=None, start=0, end=2**32):
+        '''
+        yields the readings in file order. Lines are: displayid,rawvalue,cooked unit,timestamp,signal,name,type
+        '''
+        wanted = None if not sensorids else set(str(sid) for sid in sensorids)
+        self.file.seek(0)
+        for line in self.file:
+            fields = line.rstrip('\n').split(',', 5)
+            if len(fields) < 6 or ',' not in fields[5] or ' ' not in fields[2]:
+                continue
+            if wanted is not None and fields[0] not in wanted:
+                continue
+            try:
+                timestamp = int(fields[3])
+                if timestamp < start or timestamp >= end:
+                    continue
+                value, unit = fields[2].split(' ', 1)
+                name, sensortype = fields[5].rsplit(',', 1)
+                yield {'timestamp': timestamp, 'sensorid': int(fields[0]), 'name': name, 'type': sensortype,
+                       'unit': unit, 'value': float(value), 'rawvalue': int(fields[1]), 'rawsensorid': None,
+                       'signal': None if fields[4] == '-' else int(fields[4])}
+            except ValueError:
+                continue
+
+
+def fillRollups(curs, start=0, end=2**32):
+    '''
+    recomputes the rollups of all widths for the buckets that overlap start <= timestamp < end from the readings
+    '''
+    for width in ROLLUP_WIDTHS:
+        first = start - start % width
+        last = end - end % width + width
+        curs.execute('''DELETE FROM pylarexx_rollup WHERE width = ? AND bucket >= ? AND bucket < ?;''',
+                     (width, first, last))
+        curs.execute('''INSERT INTO pylarexx_rollup SELECT sensorid, SensorType, Unit, ?,
+            CAST(timestamp AS INTEGER) - CAST(timestamp AS INTEGER) % ? AS b,
+            count(*), sum(SensorValue), min(SensorValue), max(SensorValue) FROM pylarexx
+            WHERE timestamp >= ? AND timestamp < ? GROUP BY sensorid, SensorType, Unit, b;''',
+                     (width, width, first, last))
+
+
+def formatCSV(rows, fields=CSV_FIELDS):
+    '''
+    generator that turns result rows into csv lines, starting with a header line
+    '''
+    yield ','.join(fields) + '\n'
+    for row in rows:
+        yield ','.join('' if row.get(f) is None else str(row.get(f)) for f in fields) + '\n'
+
+
+def formatJSON(rows):
+    '''
+    generator that turns result rows into a json array without building the whole array in memory
+    '''
+    separator = '['
+    for row in rows:
+        yield separator + json.dumps(row)
+        separator = ',\n'
+    if separator == '[':
+        yield '['
+    yield ']\n'
+
+
+def openStore(params):
+    '''
+    returns a store for the "store"/"filename" params of a listener config
+    '''
+    storeType = params.get('store', 'sqlite3')
+    if storeType == 'sqlite3':
+        return Sqlite3Store(params.get('filename', '/tmp/pylarexx.db'))
+    logging.error("Unknown store type %s", storeType)
+    raise ValueError('Unknown store type %s' % storeType)
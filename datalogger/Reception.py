@@ -0,0 +1,211 @@
+'''
+Created on 19.10.2026
+
+@license: pylarexx is licensed under the Apache License, version 2, see License.txt
+
+Reception statistics per sensor and receiver: rolling signal strength, distribution of the gaps between
+the timestamps of readings and estimated packet loss. Sensors send in a fixed interval, which is learned
+from the gaps, so a gap of n intervals means n - 1 missed transmissions. All statistics are updated with
+every reading, memory per sensor and receiver is constant.
+With routing, readings of a sensor that is heard by several receivers are only passed on from its best
+receiver. Readings of other receivers are held for a few seconds and passed on, if the best receiver
+missed that transmission.
+'''
+
+import time
+import bisect
+import threading
+
+GAP_BUCKETS = (30, 60, 90, 120, 180, 300, 600, 1800, 3600)  # upper bounds of the gap histogram in seconds
+
+
+class LinkStats(object):
+    '''
+    statistics of the readings of one sensor at one receiver, or of all its readings
+    '''
+
+    ALPHA = 0.1  # weight of a new signal value or interval
+
+    __slots__ = ('readings', 'signal', 'lastSignal', 'lastTimestamp', 'interval', 'missed', 'gaps', 'gapSum')
+
+    def __init__(self):
+        self.readings = 0
+        self.signal = None
+        self.lastSignal = None
+        self.lastTimestamp = None
+        self.interval = None
+        self.missed = 0
+        self.gaps = [0] * (len(GAP_BUCKETS) + 1)
+        self.gapSum = 0
+
+    def add(self, timestamp, signal):
+        '''
+        returns False for readings that are not newer than the last one, e.g. duplicates
+        '''
+        if self.lastTimestamp is not None:
+            if timestamp <= self.lastTimestamp:
+                return False
+            gap = timestamp - self.lastTimestamp
+            self.gaps[bisect.bisect_left(GAP_BUCKETS, gap)] += 1
+            self.gapSum += gap
+            # gaps with missed transmissions do not change the interval, shorter gaps correct it
+            if self.interval is None:
+                self.interval = float(gap)
+            elif gap < 1.5 * self.interval:
+                self.interval += self.ALPHA * (gap - self.interval)
+            elif gap < 86400:
+                self.missed += int(round(gap / self.interval)) - 1
+        self.lastTimestamp = timestamp
+        self.readings += 1
+        if signal is not None:
+            self.lastSignal = signal
+            self.signal = float(signal) if self.signal is None else self.signal + self.ALPHA * (signal - self.signal)
+        return True
+
+    def addLate(self):
+        '''
+        a reading older than the last one, that was counted as missed
+        '''
+        self.readings += 1
+        self.missed = max(0, self.missed - 1)
+
+    def loss(self):
+        return self.missed / float(self.readings + self.missed) if self.readings > 0 else 0.0
+
+    def score(self):
+        '''
+        higher is better: signal strength (if the receiver sends it) weighted with the received share
+        '''
+        return (1.0 if self.signal is None else self.signal) * (1.0 - self.loss())
+
+    def row(self):
+        return {'readings': self.readings, 'signal': self.signal, 'last_signal': self.lastSignal,
+                'last_timestamp': self.lastTimestamp, 'interval': self.interval, 'missed': self.missed,
+                'loss': self.loss(), 'gaps': list(self.gaps), 'gap_sum': self.gapSum}
+
+
+class ReceptionTracker(object):
+    '''
+    Keeps LinkStats per sensor key and receiver and per sensor key over all receivers.
+    reading returns False for readings that are not passed on: with routing duplicates and readings
+    of other receivers than the best one. The latter are held and returned by release, if the best
+    receiver did not pass on a reading of the same transmission within hold seconds. Receivers stamp
+    readings with their own clock, so readings less than half an interval apart are the same transmission.
+    '''
+
+    MIN_READINGS = 5  # readings of a receiver before it is compared with others
+    SWITCH_FACTOR = 1.1  # another receiver must be this much better to become the best receiver
+    MIN_TOLERANCE = 2  # seconds between readings of the same transmission while the interval is unknown
+
+    def __init__(self, routing=False, hold=5):
+        self.routing = routing
+        self.hold = hold
+        self.sensors = {}  # key -> [sensor, LinkStats of all readings, best receiver, {receiver: LinkStats}]
+        self.held = {}  # key -> {timestamp: (time held, signal, payload)}
+        self.lock = threading.Lock()
+
+    def reading(self, key, sensor, receiver, timestamp, signal, payload=None):
+        '''
+        payload is returned by release, if the reading is held
+        '''
+        with self.lock:
+            state = self.sensors.get(key)
+            if state is None:
+                state = [sensor, LinkStats(), receiver, {}]
+                self.sensors[key] = state
+            state[0] = sensor
+            links = state[3]
+            link = links.get(receiver)
+            if link is None:
+                link = LinkStats()
+                links[receiver] = link
+            link.add(timestamp, signal)
+            if len(links) > 1:
+                self.chooseBest(state, timestamp)
+            tolerance = self.tolerance(state[1].interval)
+            if self.routing and receiver != state[2]:
+                best = links[state[2]]
+                interval = state[1].interval
+                if state[1].lastTimestamp is not None and timestamp < state[1].lastTimestamp + tolerance:
+                    return False
+                if interval is not None and timestamp - best.lastTimestamp < 1.5 * interval:
+                    # the best receiver may not have been polled yet
+                    held = self.held.setdefault(key, {})
+                    if self.findHeld(held, timestamp, tolerance) is None:
+                        held[timestamp] = (time.time(), signal, payload)
+                    return False
+            if state[1].add(timestamp, signal):
+                if key in self.held:
+                    self.held[key].pop(self.findHeld(self.held[key], timestamp, tolerance), None)
+                return True
+            # duplicates are dropped with routing only
+            return not self.routing
+
+    def release(self, now=None):
+        '''
+        returns the payloads of held readings that the best receiver did not pass on
+        '''
+        now = time.time() if now is None else now
+        released = []
+        with self.lock:
+            for key, held in list(self.held.items()):
+                for timestamp, (since, signal, payload) in list(held.items()):
+                    if now - since < self.hold:
+                        continue
+                    del held[timestamp]
+                    total = self.sensors[key][1]
+                    if not total.add(timestamp, signal):
+                        total.addLate()
+                    released.append((timestamp, payload))
+                if len(held) == 0:
+                    del self.held[key]
+        released.sort(key=lambda r: r[0])
+        return [payload for timestamp, payload in released]
+
+    def tolerance(self, interval):
+        return self.MIN_TOLERANCE if interval is None else max(self.MIN_TOLERANCE, interval / 2)
+
+    @staticmethod
+    def findHeld(held, timestamp, tolerance):
+        '''
+        returns the timestamp of the held reading of the same transmission or None
+        '''
+        for heldTimestamp in held:
+            if abs(heldTimestamp - timestamp) < tolerance:
+                return heldTimestamp
+        return None
+
+    def chooseBest(self, state, timestamp):
+        links = state[3]
+        interval = state[1].interval or 0
+        current = links[state[2]]
+        # a receiver that did not hear the sensor for some intervals, e.g. unplugged, is replaced at once
+        stale = interval > 0 and timestamp - current.lastTimestamp > 3 * interval
+        bestScore = 0.0 if stale else current.score() * self.SWITCH_FACTOR
+        for receiver, link in links.items():
+            if link.readings >= self.MIN_READINGS and link.score() > bestScore:
+                if interval > 0 and timestamp - link.lastTimestamp > 3 * interval:
+                    continue
+                bestScore = link.score()
+                state[2] = receiver
+
+    def forget(self, key):
+        with self.lock:
+            self.sensors.pop(key, None)
+            self.held.pop(key, None)
+
+    def snapshot(self):
+        '''
+        returns one row per sensor and receiver, and one row per sensor with receiver None for all its readings
+        '''
+        rows = []
+        with self.lock:
+            for sensor, total, best, links in self.sensors.values():
+                info = {'sensorid': sensor.id, 'displayid': sensor.displayid, 'name': sensor.name, 'type': sensor.type}
+                for receiver, link in [(None, total)] + list(links.items()):
+                    row = link.row()
+                    row.update(info)
+                    row['receiver'] = receiver
+                    row['best'] = receiver is not None and receiver == best
+                    rows.append(row)
+        return rows
@@ -0,0 +1,155 @@
+'''
+Created on 19.10.2026
+
+@license: pylarexx is licensed under the Apache License, version 2, see License.txt
+
+Recomputes stored cooked values from the stored raw values, e.g. after calibration values were changed
+in the config. Stores are processed in chunks, so memory use does not depend on the number of readings.
+'''
+
+import os
+import logging
+import sqlite3
+from datalogger.Sensor import cookBulk
+from datalogger.Query import ROLLUP_TABLE, fillRollups
+
+
+class Recooker(object):
+    '''
+    Recooks readings with start <= timestamp < end. Sensors and calibration are taken from a TLX00 instance,
+    which should be created with the 'outputs': False param.
+    '''
+
+    def __init__(self, logger, start, end, chunksize=10000):
+        self.logger = logger
+        self.start = int(start)
+        self.end = int(end)
+        self.chunksize = int(chunksize)
+        self.resolved = {}
+
+    def sensorFor(self, rawsensorid, displayid, sensortype):
+        '''
+        finds the sensor of a stored reading. Older rows have no raw sensor id, then sensors with an id
+        near the display id are tried, since multi sensors share one display id.
+        '''
+        key = (rawsensorid, str(displayid), sensortype)
+        if key in self.resolved:
+            return self.resolved[key]
+        candidates = []
+        if rawsensorid is not None:
+            candidates.append(str(rawsensorid))
+        candidates.append(str(displayid))
+        if str(displayid).isdigit():
+            candidates += [str(int(displayid) + n) for n in (1, 2, 3)]
+        found = None
+        if rawsensorid is None:
+            found = next((s for s in self.logger.sensors.withDisplayId(displayid) if s.type == sensortype), None)
+        for sid in candidates:
+            if found is not None:
+                break
+            sensor = self.logger.sensors.get(sid)
+            if sensor is None:
+                detected_sensor = self.logger.detectSensor(sid)
+                if detected_sensor != False:
+                    self.logger.addSensor(detected_sensor)
+                    sensor = detected_sensor
+            if sensor is not None and sensor.type == sensortype:
+                found = sensor
+        if found is None:
+            logging.warning("Recooker: no sensor found for sensor %s type %s. Values are not changed.", displayid, sensortype)
+        self.resolved[key] = found
+        return found
+
+    def cook(self, keys, rawvalues):
+        '''
+        keys are (rawsensorid, displayid, sensortype) tuples. Returns cooked values, nan for unknown sensors.
+        '''
+        sensors = {}
+        indexes = []
+        for key in keys:
+            sensor = self.sensorFor(*key)
+            index = -1 if sensor is None else id(sensor)
+            sensors[index] = sensor
+            indexes.append(index)
+        sensors.pop(-1, None)
+        return cookBulk(sensors, indexes, rawvalues)
+
+    def recookSqlite(self, filename):
+        '''
+        updates SensorValue of all rows with a raw value in the time range. Each chunk is one transaction.
+        Finally the rollups of the time range are rebuilt. Returns the number of updated rows.
+        '''
+        conn = sqlite3.connect(filename)
+        curs = conn.cursor()
+        columns = [row[1] for row in curs.execute('''PRAGMA table_info(pylarexx);''')]
+        if 'rawvalue' not in columns or 'rawsensorid' not in columns:
+            # written before raw values were stored, nothing can be recomputed
+            logging.warning("Recooker: %s has no raw values. Left unchanged", filename)
+            conn.close()
+            return 0
+        lastid = -1
+        updated = 0
+        while True:
+            rows = curs.execute('''SELECT id, rawsensorid, sensorid, SensorType, rawvalue FROM pylarexx
+                WHERE id > ? AND timestamp >= ? AND timestamp < ? AND rawvalue IS NOT NULL ORDER BY id LIMIT ?;''',
+                                (lastid, self.start, self.end, self.chunksize)).fetchall()
+            if len(rows) == 0:
+                break
+            lastid = rows[-1][0]
+            cooked = self.cook([(r[1], r[2], r[3]) for r in rows], [r[4] for r in rows])
+            changes = [(float(v), r[0]) for r, v in zip(rows, cooked) if v == v]  # v == v skips nan
+            with conn:
+                curs.executemany('''UPDATE pylarexx SET SensorValue = ? WHERE id = ?;''', changes)
+            updated += len(changes)
+            logging.info("Recooker: updated %d rows in %s", updated, filename)
+        with conn:
+            curs.execute(ROLLUP_TABLE)
+            self.rebuildRollups(curs)
+        conn.close()
+        return updated
+
+    def rebuildRollups(self, curs):
+        fillRollups(curs, self.start, self.end)
+
+    def recookFile(self, filename):
+        '''
+        rewrites a FileOutListener file. The new file is written next to the old one and replaces it at the end,
+        so pylarexx should not write to the file at the same time. Returns the number of updated lines.
+        '''
+        tmpname = filename + '.recook'
+        updated = 0
+        with open(filename, 'r') as infile, open(tmpname, 'w') as outfile:
+            while True:
+                lines = infile.readlines(self.chunksize * 64)
+                if len(lines) == 0:
+                    break
+                parsed = [self.parseLine(line) for line in lines]
+                todo = [n for n, p in enumerate(parsed) if p is not None]
+                cooked = self.cook([parsed[n][0] for n in todo], [parsed[n][1] for n in todo])
+                for n, value in zip(todo, cooked):
+                    if value == value:
+                        fields = parsed[n][2]
+                        fields[2] = '%f %s' % (value, fields[2].split(' ', 1)[1])
+                        lines[n] = ','.join(fields)
+                        updated += 1
+                outfile.writelines(lines)
+        os.replace(tmpname, filename)
+        return updated
+
+    def parseLine(self, line):
+        '''
+        FileOutListener lines are: displayid,rawvalue,cooked unit,timestamp,signal,name,type
+        returns (key, rawvalue, fields) or None if the line is outside the time range or not parseable
+        '''
+        fields = line.split(',', 5)
+        if len(fields) < 6 or ',' not in fields[5] or ' ' not in fields[2]:
+            return None
+        sensortype = fields[5].rsplit(',', 1)[1]
+        try:
+            timestamp = int(fields[3])
+            rawvalue = int(fields[1])
+        except ValueError:
+            return None
+        if timestamp < self.start or timestamp >= self.end:
+            return None
+        return (None, fields[0], sensortype.rstrip('\n')), rawvalue, fields
@@ -6,12 +6,32 @@ Created on 23.11.2017
 
 '''
 
+import time
 import logging
 import xml.etree.ElementTree
 import sys
 import os
 from pprint import pformat
 
+
+numpyModule = False  # not imported yet, None if numpy is not installed
+
+
+def loadNumpy():
+    '''
+    numpy is only needed for bulk conversion (e.g. --recook), so it is imported on first use.
+    Returns None if numpy is not installed, the result is kept, so the import is tried once
+    '''
+    global numpyModule
+    if numpyModule is False:
+        try:
+            import numpy
+            numpyModule = numpy
+        except ModuleNotFoundError:
+            numpyModule = None
+    return numpyModule
+
+
 class Sensor(object):
     '''
     Sensor base class for datalogger
@@ -22,7 +42,10 @@ class Sensor(object):
         '''
         self.id = str(sensorid) # since probably not every id is numeric
         self.name = self.id
-        self.displayid = self.id
+        self.displayid = int(self.id) if self.id.isdigit() else self.id
+        # valid range of cooked values, subclasses with known limits narrow it
+        self.valmin = float('-inf')
+        self.valmax = float('inf')
         self.type = "unknown"
         self.manufacturerType = "unknown"
         self.unit = "unknown"
@@ -45,9 +68,33 @@ class Sensor(object):
         return self
 
 
-    def rawToCooked(self, raw):
+    def polynomial(self):
+        '''
+        returns the coefficients (a0, a1, a2) of cooked = a0 + raw*a1 + raw*raw*a2, calibration values included
+        '''
         raise NotImplementedError
 
+    def hasConversion(self):
+        '''
+        False for sensors of unknown type, e.g. configured ids that are not in deviceinfo.xml
+        '''
+        return type(self).polynomial is not Sensor.polynomial
+
+    def rawToCooked(self, raw):
+        a0, a1, a2 = self.polynomial()
+        return a0 + raw*a1 + raw*raw*a2
+
+    def rawToCookedArray(self, raw):
+        '''
+        converts a sequence of raw values at once. Returns a numpy array, or a list if numpy is not installed
+        '''
+        numpy = loadNumpy()
+        if numpy is None:
+            return [self.rawToCooked(r) for r in raw]
+        a0, a1, a2 = self.polynomial()
+        raw = numpy.asarray(raw, dtype=numpy.float64)
+        return a0 + raw*a1 + raw*raw*a2
+
     def calibrate(self, calibrationValues):
         '''
         provide calibration parameters as a dictionary. The implementation of the sensor
@@ -104,7 +151,8 @@ class ArexxSensorDetector:
 
                 ArexxSensorDetector.arexxDeviceInfo.append({'type': dtype, 'unit': unit, 'm1': m1, 'm2': m2, 'dm': dm, 'vLo': vLo, 'vUp': vUp, 'p0': p0, 'p1':p1, 'p2':p2, 'manufacturerType': manufacturerType})
 
-            logging.debug(pformat(ArexxSensorDetector.arexxDeviceInfo))
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(pformat(ArexxSensorDetector.arexxDeviceInfo))
         except Exception as e:
             logging.error("Problem reading deviceinfo.xml: %s",e)
             exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -130,11 +178,11 @@ class ArexxSensor(Sensor):
         self.p2 = p2
         logging.info("Created new autodetect Arexx Sensor: %s", vars(self))
 
-    def rawToCooked(self, raw):
+    def polynomial(self):
         c0=self.calibrationValues.get(0,0.0)
         c1=self.calibrationValues.get(1,0.0)
         c2=self.calibrationValues.get(2,0.0)
-        return self.p0 +c0 + raw*(self.p1+c1) + raw*raw*(self.p2+c2)
+        return self.p0 +c0, self.p1+c1, self.p2+c2
 
 # Compute Values from device.xml from original software
 class ArexxTemperatureSensor(Sensor):
@@ -142,33 +190,52 @@ class ArexxTemperatureSensor(Sensor):
     def __init__(self, sensorid, manufacturerType, name):
         super().__init__(sensorid)
         self.setType("Temperature").setUnit("°C").setName(name).setManufacturerType(manufacturerType)
+        self.typeWarningLogged = False
 
-    def rawToCooked(self,raw):
+    def polynomial(self):
         c0=self.calibrationValues.get(0,0.0)
         c1=self.calibrationValues.get(1,0.0)
-        if self.manufacturerType=='TSN-TH70E':
-            return -39.6 +c0 + raw*(0.01+c1)
         if self.manufacturerType=='TL-3TSN':
-            return c0+raw*(0.0078125+c1)
+            return c0, 0.0078125+c1, 0.0
+        return -39.6 +c0, 0.01+c1, 0.0
+
+    def rawToCooked(self,raw):
+        if self.manufacturerType in ('TSN-TH70E', 'TL-3TSN'):
+            return super().rawToCooked(raw)
         # fallback default
-        logging.info("Set Temperature Sensor Type in config for exact values: Sensor %s" % self.id)
-        t = -39.6 +c0 + raw*(0.01+c1)
+        if not self.typeWarningLogged:
+            logging.info("Set Temperature Sensor Type in config for exact values: Sensor %s", self.id)
+            self.typeWarningLogged = True
+        t = super().rawToCooked(raw)
         if t > -20 and t < 50:
             return t
         else:
+            c0=self.calibrationValues.get(0,0.0)
+            c1=self.calibrationValues.get(1,0.0)
             return c0+raw*(0.0078125+c1)
 
+    def rawToCookedArray(self, raw):
+        numpy = loadNumpy()
+        if numpy is None or self.manufacturerType in ('TSN-TH70E', 'TL-3TSN'):
+            return super().rawToCookedArray(raw)
+        # fallback default, guess the formula for each value
+        c0=self.calibrationValues.get(0,0.0)
+        c1=self.calibrationValues.get(1,0.0)
+        raw = numpy.asarray(raw, dtype=numpy.float64)
+        t = super().rawToCookedArray(raw)
+        return numpy.where((t > -20) & (t < 50), t, c0+raw*(0.0078125+c1))
+
 class ArexxHumiditySensor(Sensor):
 
     def __init__(self, sensorid, manufacturerType, name):
         super().__init__(sensorid)
         self.setType("Humidity").setUnit("%RH").setName(name).setManufacturerType(manufacturerType)
 
-    def rawToCooked(self,raw):
+    def polynomial(self):
         c0=self.calibrationValues.get(0,0.0)
         c1=self.calibrationValues.get(1,0.0)
         c2=self.calibrationValues.get(2,0.0)
-        return -4.0 +c0 + raw*(0.0405+c1) + raw*raw*(-0.0000028+c2)
+        return -4.0 +c0, 0.0405+c1, -0.0000028+c2
 
 class ArexxCO2Sensor(Sensor):
 
@@ -176,8 +243,141 @@ class ArexxCO2Sensor(Sensor):
         super().__init__(sensorid)
         self.setType("CO2").setUnit("ppm").setName(name).setManufacturerType(manufacturerType)
 
-    def rawToCooked(self,raw):
+    def polynomial(self):
         c0=self.calibrationValues.get(0,0.0)
         c1=self.calibrationValues.get(1,0.0)
         c2=self.calibrationValues.get(2,0.0)
-        return c0 + raw*(1.0+c1) + raw*raw*(0.00000+c2)
+        return c0, 1.0+c1, 0.00000+c2
+
+
+class SensorRegistry(object):
+    '''
+    Holds the sensors of a logger by normalized id (the string form of the raw sensor id, like Sensor.id)
+    with an index by display id. Ids are normalized once, so callers with a normalized id need a single
+    dict lookup per reading. Ids that were detected as unknown (e.g. ghost ids of radio noise) are remembered
+    for UNKNOWN_TIMEOUT seconds, at most MAX_UNKNOWN of them, and until the registry is replaced on the next
+    config (re)load. Reading counts and last seen timestamps per sensor are kept by
+    the reception statistics (see datalogger.Reception), the registry only resolves ids.
+    Supports the dict operations used on TLX00.sensors, keys can be given as int or str.
+    '''
+
+    MAX_UNKNOWN = 1000
+    UNKNOWN_TIMEOUT = 3600
+
+    def __init__(self):
+        self.byId = {}
+        self.byDisplayId = {}
+        self.unknownIds = {}  # id -> time it was detected as unknown, oldest first
+
+    @staticmethod
+    def normalizeId(sensorid):
+        return sensorid if type(sensorid) is str else str(sensorid)
+
+    def add(self, sensor, key=None):
+        key = sensor.id if key is None else self.normalizeId(key)
+        if key in self.byId:
+            self.removeFromDisplayIndex(key, self.byId[key])
+        self.byId[key] = sensor
+        self.byDisplayId.setdefault(self.normalizeId(sensor.displayid), []).append(sensor)
+        self.unknownIds.pop(key, None)
+
+    def removeFromDisplayIndex(self, key, sensor):
+        displayKey = self.normalizeId(sensor.displayid)
+        sensors = [s for s in self.byDisplayId.get(displayKey, []) if s is not sensor]
+        if len(sensors) > 0:
+            self.byDisplayId[displayKey] = sensors
+        else:
+            self.byDisplayId.pop(displayKey, None)
+
+    def lookup(self, key):
+        '''
+        returns the sensor of a normalized id or None
+        '''
+        return self.byId.get(key)
+
+    def withDisplayId(self, displayid):
+        return self.byDisplayId.get(self.normalizeId(displayid), [])
+
+    def markUnknown(self, key):
+        self.unknownIds.pop(key, None)
+        if len(self.unknownIds) >= self.MAX_UNKNOWN:
+            del self.unknownIds[next(iter(self.unknownIds))]
+        self.unknownIds[key] = time.monotonic()
+
+    def isUnknown(self, key):
+        marked = self.unknownIds.get(key)
+        if marked is None:
+            return False
+        if time.monotonic() - marked > self.UNKNOWN_TIMEOUT:
+            # detected again, e.g. after deviceinfo.xml was updated
+            del self.unknownIds[key]
+            return False
+        return True
+
+    def __setitem__(self, key, sensor):
+        self.add(sensor, key)
+
+    def __getitem__(self, key):
+        return self.byId[self.normalizeId(key)]
+
+    def __contains__(self, key):
+        return self.normalizeId(key) in self.byId
+
+    def __iter__(self):
+        return iter(self.byId)
+
+    def __len__(self):
+        return len(self.byId)
+
+    def get(self, key, default=None):
+        return self.byId.get(self.normalizeId(key), default)
+
+    def pop(self, key, *default):
+        key = self.normalizeId(key)
+        if key in self.byId:
+            self.removeFromDisplayIndex(key, self.byId[key])
+        return self.byId.pop(key, *default)
+
+    def keys(self):
+        return self.byId.keys()
+
+    def values(self):
+        return self.byId.values()
+
+    def items(self):
+        return self.byId.items()
+
+
+def cookBulk(sensors, sensorids, rawvalues):
+    '''
+    converts the raw values of many readings at once, e.g. for a flash backlog or for stored history.
+    sensors maps sensor ids to Sensor objects, sensorids and rawvalues are sequences of equal length.
+    Readings are grouped by sensor id and each group is converted with one array operation.
+    Returns an array (a list without numpy) with nan for readings of unknown sensors.
+    '''
+    def lookup(sid):
+        return sensors.get(sid, sensors.get(str(sid)))
+
+    numpy = loadNumpy()
+    if numpy is None:
+        cooked = []
+        for sid, raw in zip(sensorids, rawvalues):
+            sensor = lookup(sid)
+            cooked.append(float('nan') if sensor is None else sensor.rawToCooked(raw))
+        return cooked
+
+    raws = numpy.asarray(rawvalues, dtype=numpy.float64)
+    cooked = numpy.full(len(raws), numpy.nan)
+    if len(raws) == 0:
+        return cooked
+    uniqueIds, inverse = numpy.unique(numpy.asarray(sensorids), return_inverse=True)
+    order = numpy.argsort(inverse, kind='stable')
+    bounds = numpy.cumsum(numpy.bincount(inverse, minlength=len(uniqueIds)))
+    begin = 0
+    for sid, end in zip(uniqueIds, bounds):
+        sensor = lookup(sid.item())
+        if sensor is not None:
+            group = order[begin:end]
+            cooked[group] = sensor.rawToCookedArray(raws[group])
+        begin = end
+    return cooked
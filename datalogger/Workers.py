@@ -0,0 +1,208 @@
+'''
+Created on 19.10.2026
+
+@license: pylarexx is licensed under the Apache License, version 2, see License.txt
+
+Runs outputs in worker processes. With "Workers: n" in the config section, the output config is split into
+n shards. The USB process registers one WorkerListener per shard, which passes the readings over a queue
+to a worker process. The worker process creates the listeners of its shard and calls them. The polling loop
+supervises the workers and restarts crashed ones, the USB side is not affected.
+'''
+
+import time
+import zlib
+import queue
+import signal
+import inspect
+import logging
+import multiprocessing
+import yaml
+from datalogger.DataListener import DataListener, findListenerClass
+from datalogger.LogUtil import rateLimited
+
+
+def shardOutputs(outputs, workers, logInterval=300):
+    '''
+    splits the output config into one WorkerListener output per worker. Outputs with a "worker" key
+    go to that worker, the others by a hash of their config. So adding or removing an output does not
+    move the other outputs and their workers keep running. logInterval is RepeatedLogInterval of the config.
+    '''
+    shards = [[] for n in range(workers)]
+    for output in outputs:
+        if 'worker' in output:
+            shards[int(output['worker']) % workers].append(output)
+        else:
+            shards[zlib.crc32(yaml.dump(output, sort_keys=True).encode('UTF-8')) % workers].append(output)
+    return [{'type': 'datalogger.Workers.WorkerListener',
+             'params': {'worker': n, 'outputs': shard, 'log_interval': logInterval}}
+            for n, shard in enumerate(shards) if len(shard) > 0]
+
+
+def workerMain(outputs, messages, loglevel, logInterval):
+    '''
+    main function of a worker process. Messages are ('sensor', id, sensor), ('data', id, datapoint),
+    ('status', id, online, last seen), ('alert', alert), ('reception', rows) and ('stop', timeout).
+    '''
+    # shutdown and reload are controlled by the USB process
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, signal.SIG_IGN)
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(processName)s - %(filename)s:%(lineno)s - %(funcName)s -  %(message)s', level=loglevel)
+    rateLimited.interval = logInterval
+    listeners = []
+    for output in outputs:
+        try:
+            listener = findListenerClass(output.get('type'))(output.get('params', {}))
+            if inspect.iscoroutinefunction(listener.onNewData):
+                logging.error('Output %s needs the asyncio engine and can not run in a worker', output.get('type'))
+                continue
+            listener.start()
+            listeners.append(listener)
+        except Exception as e:
+            logging.error('Error in config section output: %s', e)
+            logging.debug('Stacktrace: ', exc_info=True)
+    sensors = {}
+    timeout = 10
+    lastFlush = time.time()
+    while True:
+        try:
+            message = messages.get(timeout=10)
+        except queue.Empty:
+            message = ('idle',)
+        if time.time() - lastFlush >= 10:
+            rateLimited.flush()
+            lastFlush = time.time()
+        if message[0] == 'data':
+            sensor = sensors.get(message[1])
+            if sensor is None:
+                continue
+            for l in listeners:
+                try:
+                    l.onNewData(message[2], sensor)
+                except Exception as e:
+                    rateLimited.error(('worker', type(l).__name__), "Error in DataListener %s: %s", type(l).__name__, e)
+        elif message[0] == 'sensor':
+            sensors[message[1]] = message[2]
+        elif message[0] == 'status' and message[1] in sensors:
+            for l in listeners:
+                try:
+                    l.onSensorStatus(sensors[message[1]], message[2], message[3])
+                except Exception as e:
+                    rateLimited.error(('worker', type(l).__name__), "Error in DataListener %s: %s", type(l).__name__, e)
+        elif message[0] == 'alert':
+            for l in listeners:
+                try:
+                    l.onAlert(message[1])
+                except Exception as e:
+                    rateLimited.error(('worker', type(l).__name__), "Error in DataListener %s: %s", type(l).__name__, e)
+        elif message[0] == 'reception':
+            for l in listeners:
+                try:
+                    l.onReceptionStats(message[1])
+                except Exception as e:
+                    rateLimited.error(('worker', type(l).__name__), "Error in DataListener %s: %s", type(l).__name__, e)
+        elif message[0] == 'stop':
+            timeout = message[1]
+            break
+    deadline = time.time() + timeout
+    for l in listeners:
+        try:
+            l.flush(max(0.0, deadline - time.time()))
+            l.close()
+        except Exception as e:
+            logging.error("Error closing DataListener %s: %s", type(l).__name__, e)
+
+
+class WorkerListener(DataListener):
+    '''
+    Passes readings to a worker process that runs the outputs in params['outputs'].
+    Sensors are sent once and again after they changed, readings only carry the sensor id.
+    If the queue is full (params queue_size, default 10000), readings are dropped.
+    '''
+
+    def __init__(self, params):
+        super().__init__(params)
+        self.worker = params.get('worker', 0)
+        self.outputs = params.get('outputs', [])
+        self.logInterval = float(params.get('log_interval', 300))
+        self.queueSize = int(params.get('queue_size', 10000))
+        self.context = multiprocessing.get_context('spawn')
+        self.process = None
+        self.messages = None
+        self.sentSensors = {}
+        self.restarts = 0
+
+    def start(self):
+        self.sentSensors = {}
+        self.messages = self.context.Queue(self.queueSize)
+        self.process = self.context.Process(target=workerMain, name='pylarexx-worker-%d' % self.worker,
+                                            args=(self.outputs, self.messages, logging.getLogger().level, self.logInterval))
+        self.process.daemon = True
+        self.process.start()
+        logging.info("Started worker %d (pid %d) with outputs %s", self.worker, self.process.pid,
+                     ', '.join(str(o.get('type')) for o in self.outputs))
+
+    def onNewData(self, data, sensor):
+        try:
+            sent = self.sentSensors.get(sensor.id)
+            # reloads replace the calibration dict, so the worker gets the sensor again
+            if sent is None or sent[0] is not sensor or sent[1] is not sensor.calibrationValues:
+                self.messages.put_nowait(('sensor', sensor.id, sensor))
+                self.sentSensors[sensor.id] = (sensor, sensor.calibrationValues)
+            self.messages.put_nowait(('data', sensor.id, data))
+        except queue.Full:
+            rateLimited.error(('queue', self.worker), "Queue of worker %d is full. Dropping readings", self.worker)
+
+    def onSensorStatus(self, sensor, online, lastSeen):
+        if sensor.id not in self.sentSensors:
+            return
+        try:
+            self.messages.put_nowait(('status', sensor.id, online, lastSeen))
+        except queue.Full:
+            rateLimited.error(('queue', self.worker), "Queue of worker %d is full. Dropping status of sensor %s", self.worker, sensor.id)
+
+    def onAlert(self, alert):
+        try:
+            self.messages.put_nowait(('alert', alert))
+        except queue.Full:
+            rateLimited.error(('queue', self.worker), "Queue of worker %d is full. Dropping alert %s", self.worker, alert['rule'])
+
+    def onReceptionStats(self, rows):
+        try:
+            self.messages.put_nowait(('reception', rows))
+        except queue.Full:
+            rateLimited.error(('queue', self.worker), "Queue of worker %d is full. Dropping reception statistics", self.worker)
+
+    def supervise(self):
+        '''
+        restarts the worker process, if it died. Readings still in the queue of the dead worker are lost.
+        '''
+        if self.process is None or self.process.is_alive():
+            return
+        self.restarts += 1
+        logging.error("Worker %d died with exit code %s. Restarting (restart %d)", self.worker,
+                      self.process.exitcode, self.restarts)
+        self.messages.close()
+        self.start()
+
+    def flush(self, timeout):
+        '''
+        the worker drains its queue, flushes and closes its outputs and exits
+        '''
+        if self.process is None or not self.process.is_alive():
+            return True
+        deadline = time.time() + timeout
+        try:
+            self.messages.put(('stop', timeout / 2), timeout=timeout / 2)
+        except queue.Full:
+            return False
+        self.process.join(max(0.0, deadline - time.time()))
+        return not self.process.is_alive()
+
+    def close(self):
+        if self.process is not None:
+            if self.process.is_alive() and not self.flush(5):
+                logging.error("Worker %d did not stop in time. Terminating", self.worker)
+                self.process.terminate()
+                self.process.join(1)
+            self.messages.close()
+            self.process = None
@@ -16,6 +16,8 @@ pylarexx -- Reads data from a Arexx TL-300 or TL-500 Datalogger
 import sys
 import os
 import datalogger.Logger
+from datalogger.Recook import Recooker
+from datetime import datetime
 from argparse import ArgumentParser
 from argparse import RawDescriptionHelpFormatter
 import logging
@@ -26,8 +28,6 @@ __date__ = '2017-11-22'
 __updated__ = '2020-03-14'
 
 DEBUG = 0
-TESTRUN = 0
-PROFILE = 0
 
 class CLIError(Exception):
     '''Generic exception to raise and log different fatal errors.'''
@@ -39,6 +39,30 @@ class CLIError(Exception):
     def __unicode__(self):
         return self.msg
 
+def parseTime(value):
+    '''unix timestamp or ISO 8601 date/time (local time)'''
+    try:
+        return int(value)
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp())
+
+def recook(conffile, start, end, chunksize):
+    '''
+    recomputes the stored values of all Sqlite3Listener and FileOutListener outputs in conffile
+    with the current sensor and calibration config
+    '''
+    myDataLogger = datalogger.Logger.TLX00({'conffile': conffile, 'outputs': False})
+    recooker = Recooker(myDataLogger, start, end, chunksize)
+    for output in myDataLogger.config.get('output', []):
+        params = output.get('params', {})
+        if output.get('type') == 'Sqlite3Listener':
+            filename = params.get('filename', '/tmp/pylarexx.db')
+            logging.warning("Recooked %d rows in %s", recooker.recookSqlite(filename), filename)
+        elif output.get('type') == 'FileOutListener':
+            filename = params.get('filename', '/tmp/pylarexx.out')
+            logging.warning("Recooked %d lines in %s", recooker.recookFile(filename), filename)
+    return 0
+
 def main(argv=None): # IGNORE:C0111
     '''Command line options.'''
 
@@ -71,6 +95,21 @@ USAGE
         parser.add_argument("-f", "--file", dest="conffile", default="/etc/pylarexx.yml", help="Configfile for sensors, calibration and output.")
         parser.add_argument("-v", "--verbose", dest="verbose", action="count", help="set verbosity level [default: %(default)s]")
         parser.add_argument('-V', '--version', action='version', version=program_version_message)
+        parser.add_argument("-e", "--engine", dest="engine", choices=["threads", "asyncio"], default="threads", help="polling engine. asyncio supports outputs with async onNewData [default: %(default)s]")
+        parser.add_argument("--recook", dest="recook", action="store_true", help="recompute stored values of sqlite and file outputs with the current calibration and exit. Stop the service while recooking file outputs.")
+        parser.add_argument("--export", dest="export", metavar="FORMAT", help="write stored readings as csv, jsonl, influx or parquet to stdout or --output and exit. parquet needs pyarrow.")
+        parser.add_argument("--store", dest="store", help="sqlite database or FileOutListener file for --export [default: first Sqlite3Listener or FileOutListener output in the config file]")
+        parser.add_argument("--sensor", dest="sensors", type=int, action="append", help="display id of a sensor to --export, can be given more than once [default: all]")
+        parser.add_argument("-o", "--output", dest="output", default="-", help="file for --export, - is stdout [default: %(default)s]")
+        parser.add_argument("--from", dest="start", type=parseTime, default=0, help="start of the time range for --recook and --export, unix timestamp or ISO date [default: all]")
+        parser.add_argument("--to", dest="end", type=parseTime, default=2**32, help="end of the time range for --recook and --export, unix timestamp or ISO date [default: all]")
+        parser.add_argument("--chunksize", dest="chunksize", type=int, default=10000, help="readings per chunk for --recook and parquet row group size for --export [default: %(default)s]")
+        parser.add_argument("--benchmark", dest="benchmark", type=int, metavar="READINGS", help="run the given number of synthetic readings through sensors and outputs of the config file and exit. Does not use USB devices.")
+        parser.add_argument("--packets", dest="packets", help="file with recorded packets (one 64 byte packet per line as hex) for --benchmark instead of synthetic readings")
+        parser.add_argument("--profile", dest="profile", metavar="FILE", help="also run the benchmark with cProfile and write the stats to FILE (read them with python -m pstats FILE)")
+        parser.add_argument("--baseline", dest="baseline", metavar="FILE", help="compare the benchmark with the results in FILE and exit with 1, if throughput or memory regressed")
+        parser.add_argument("--save-baseline", dest="saveBaseline", action="store_true", help="write the benchmark results to the --baseline file instead of comparing")
+        parser.add_argument("--threshold", dest="threshold", type=float, default=20.0, help="allowed regression against the baseline in percent [default: %(default)s]")
         # parser.add_argument(dest="paths", help="paths to folder(s) with source file(s) [default: %(default)s]", metavar="path", nargs='+')
 
         # Process arguments
@@ -92,38 +131,50 @@ USAGE
         ### handle keyboard interrupt ###
         return 0
     except Exception as e:
-        if DEBUG or TESTRUN:
+        if DEBUG:
             raise(e)
         indent = len(program_name) * " "
         sys.stderr.write(program_name + ": " + repr(e) + "\n")
         sys.stderr.write(indent + "  for help use --help")
         return 2
 
+    if args.recook:
+        return recook(conffile, args.start, args.end, args.chunksize)
+    if args.export is not None:
+        # commands and engines are imported when they are used, so the daemon starts without them
+        from datalogger.Export import FORMATS, export
+        if args.export not in FORMATS:
+            parser.error("argument --export: invalid choice: '%s' (choose from %s)" % (args.export, ', '.join(FORMATS)))
+        config = {}
+        if args.store is None:
+            config = datalogger.Logger.TLX00({'conffile': conffile, 'outputs': False}).config
+        return export(config, args.export, args.store, args.output, args.sensors, args.start, args.end, args.chunksize)
+    if args.benchmark is not None or args.profile is not None:
+        from datalogger.Benchmark import benchmark
+        return benchmark(conffile, args.benchmark or 100000, args.packets, args.profile, args.baseline,
+                         args.saveBaseline, args.threshold)
+
     params={}
     if conffile != None:
         params['conffile']=conffile
+    if args.engine == 'asyncio':
+        from datalogger.AsyncEngine import AsyncTLX00
+        AsyncTLX00(params).run()
+        return 0
+
     myDataLogger = datalogger.Logger.TLX00(params)
+    myDataLogger.installSignalHandlers()
     myDataLogger.findDevices()
     myDataLogger.initializeDevices()
-    myDataLogger.loop()
+    try:
+        myDataLogger.loop()
+    finally:
+        myDataLogger.shutdown()
+    return 0
 
 
 
 if __name__ == "__main__":
     if DEBUG:
         sys.argv.append("-vvv")
-    if TESTRUN:
-        import doctest
-        doctest.testmod()
-    if PROFILE:
-        import cProfile
-        import pstats
-        profile_filename = 'pylarexx_profile.txt'
-        cProfile.run('main()', profile_filename)
-        statsfile = open("profile_stats.txt", "wb")
-        p = pstats.Stats(profile_filename, stream=statsfile)
-        stats = p.strip_dirs().sort_stats('cumulative')
-        stats.print_stats()
-        statsfile.close()
-        sys.exit(0)
     sys.exit(main())